@@ -62,21 +62,38 @@ def create_app(config_name):
     from .service import service as service_blueprint
     app.register_blueprint(service_blueprint, url_prefix='/service')
 
+    from app.utils.response import compress_response
+
     @app.after_request
     def set_csrf_token_cookie(response):
         csrf_token = getattr(request, 'csrf_token', None)
         if csrf_token is not None:
             response.set_cookie('csrf_token', csrf_token, max_age=3600)
         return response
+    app.after_request(compress_response)
+
+    from app import dictionary, experience, nearby
+    from app.utils.redis import register_sync, sync_versions
+    register_sync(app, '%s:VERSION' % dictionary.DICTIONARY, dictionary.sync_dictionary)
+    register_sync(app, '%s:SEQUENCE' % nearby.NEARBY, nearby.sync_nearby)
+    register_sync(app, '%s:SEQUENCE' % experience.EXPERIENCE, experience.sync_stores)
+    app.before_request(sync_versions)
 
     @app.errorhandler(404)
     def page_not_found(error):
         return render_template('user/404.html'), 404
 
     if config_name != 'testing':
-        from app import statisitc
+        from app import statisitc, snapshot
         with app.app_context():
-            statisitc.init_statistic()
+            snapshot.load_snapshot(app.config['SNAPSHOT_PATH'])
+
+        def sync_statistic(latest):
+            if statisitc.item_facets is None:
+                statisitc.load_statistic()
+            else:
+                statisitc.sync_statistic(latest)
+        register_sync(app, '%s:GENERATION' % statisitc.STATISTIC, sync_statistic)
 
     return app
 
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+from app import db
+
+# 直辖市的城市名不出现在地址中
+MUNICIPALITIES = ('北京市', '上海市', '天津市', '重庆市')
+
+_index = None
+
+AreaRow = namedtuple('AreaRow', ('id', 'cn_id', 'area', 'father_id', 'level', 'pinyin', 'pinyin_index'))
+
+
+class AreaNode(object):
+    """
+    只读的地区节点, 祖先链, 地址和下级地区在读入时计算好
+    """
+    __slots__ = ('id', 'cn_id', 'area', 'father_id', 'level', 'pinyin', 'pinyin_index',
+                 'father', '_grades', '_address', '_children')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.cn_id = row.cn_id
+        self.area = row.area
+        self.father_id = row.father_id
+        self.level = row.level
+        self.pinyin = row.pinyin
+        self.pinyin_index = row.pinyin_index
+        self.father = None
+        self._grades = ()
+        self._address = ''
+        self._children = []
+
+    def grade(self):
+        return list(self._grades)
+
+    def area_address(self):
+        return self._address
+
+    def children(self):
+        return list(self._children)
+
+    def city(self):
+        if self.level == 2:
+            return self
+        return self.father
+
+    def experience_dict(self, distributor_id):
+        if self.level == 3:
+            third_area = self
+            second_area = self.father
+        else:
+            third_area = second_area = self
+        first_area = second_area.father
+        return {first_area.cn_id: {'area': first_area.area, 'children': {
+            second_area.cn_id: {'area': second_area.area, 'children': {
+                third_area.cn_id: {'area': third_area.area, 'distributors': [distributor_id]}
+            }}
+        }}}
+
+
+class AreaIndex(object):
+    def __init__(self, rows):
+        self.by_id = {row.id: AreaNode(row) for row in rows}
+        self.by_cn_id = {}
+        for node in sorted(self.by_id.values(), key=lambda node: node.id):
+            self.by_cn_id.setdefault(node.cn_id, node)
+            father = self.by_id.get(node.father_id)
+            if father is not None:
+                node.father = father
+                father._children.append(node)
+        for node in self.by_id.values():
+            grades = []
+            area = node
+            while area is not None:
+                grades.append(area)
+                area = area.father
+            grades.reverse()
+            node._grades = tuple(grades)
+            node._address = ''.join(area.area for area in grades if area.area not in MUNICIPALITIES)
+
+    def rows(self):
+        return [AreaRow(node.id, node.cn_id, node.area, node.father_id, node.level, node.pinyin, node.pinyin_index)
+                for node in self.by_id.values()]
+
+    def get(self, id_):
+        return self.by_id.get(id_)
+
+    def find(self, cn_id):
+        try:
+            return self.by_cn_id.get(int(cn_id))
+        except (TypeError, ValueError):
+            return None
+
+
+def get_index():
+    """
+    地区表不会变化, 每个进程只读取一次
+    """
+    global _index
+    if _index is None or not _index.by_id:
+        from app.models import Area
+        _index = AreaIndex(db.session.query(Area.id, Area.cn_id, Area.area, Area.father_id, Area.level,
+                                            Area.pinyin, Area.pinyin_index).all())
+    return _index
+
+
+def restore_index(rows):
+    global _index
+    _index = AreaIndex([AreaRow(*row) for row in rows])
+
+
+def get_area(id_):
+    return get_index().get(id_)
+
+
+def find_area(cn_id):
+    return get_index().find(cn_id)
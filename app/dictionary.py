@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from flask.ext.sqlalchemy import models_committed
+
+from app import local_redis
+
+DICTIONARY = 'DICTIONARY'
+
+# 字典表很小且几乎不变, 每个进程第一次用到时整表读入内存.
+# 任何进程提交了字典表的修改都会增加 redis 中的版本号, 其他进程在下一个请求时清空缓存.
+
+_models = {}
+_tables = {}
+version = 0
+
+
+def register(*models):
+    for model in models:
+        _models[model.__tablename__] = model
+
+
+def table(model):
+    """
+    {id: {字段: 值}}
+    """
+    name = model.__tablename__
+    if name not in _tables:
+        columns = [column.name for column in model.__table__.columns]
+        _tables[name] = {row.id: {column: getattr(row, column) for column in columns} for row in model.query}
+    return _tables[name]
+
+
+def value(model, id_, attr, default=None):
+    row = table(model).get(id_)
+    return row[attr] if row is not None else default
+
+
+def dump_tables():
+    """
+    读入所有字典表, 用于写入快照
+    """
+    return {name: table(model) for name, model in _models.items()}
+
+
+def restore_tables(tables, tables_version):
+    """
+    从快照恢复, 版本落后时在下一个请求清空
+    """
+    global version
+    _tables.clear()
+    _tables.update((name, tables[name]) for name in tables if name in _models)
+    version = tables_version
+
+
+def sync_dictionary(latest=None):
+    global version
+    if latest is None:
+        latest = int(local_redis.get('%s:VERSION' % DICTIONARY) or 0)
+    if latest != version:
+        _tables.clear()
+        version = latest
+
+
+@models_committed.connect
+def _on_models_committed(sender, changes):
+    global version
+    if any(getattr(instance, '__tablename__', None) in _models for instance, operation in changes):
+        _tables.clear()
+        version = local_redis.incr('%s:VERSION' % DICTIONARY)
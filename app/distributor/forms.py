@@ -6,8 +6,10 @@ from wtforms import StringField, PasswordField
 from wtforms.validators import DataRequired, Length, EqualTo, ValidationError
 
 from app import db
+from app.areas import find_area
 from app.forms import Form
 from app.models import Distributor, DistributorAddress
+from app.signals import distributor_changed
 from app.utils.validator import AreaValidator
 from app.tasks import distributor_geo_coding
 
@@ -58,7 +60,7 @@ class RegisterForm(Form):
         )
         db.session.add(distributor_address)
         db.session.commit()
-        distributor_address.update_distributor_amount()
+        distributor_address.change_distributor_amount(1)
         distributor_geo_coding.delay(distributor.id, distributor_address.id)
         return distributor
 
@@ -98,11 +100,16 @@ class SettingsForm(Form):
         current_user.contact_telephone = self.contact_telephone.data
         current_user.contact_mobile = self.contact_mobile.data
         geo_coding = False
+        old_cn_id = current_user.address.cn_id
         if current_user.address.address != self.address.data or current_user.address.cn_id != self.district_cn_id.data:
             geo_coding = True
             current_user.address.address = self.address.data
             current_user.address.cn_id = self.district_cn_id.data
         db.session.commit()
-        current_user.address.update_distributor_amount()
+        old_area, new_area = find_area(old_cn_id), find_area(current_user.address.cn_id)
+        if (old_area.city() if old_area else None) is not (new_area.city() if new_area else None):
+            current_user.address.change_distributor_amount(-1, old_cn_id)
+            current_user.address.change_distributor_amount(1)
         if geo_coding:
+            distributor_changed.send(current_app._get_current_object(), distributor=current_user._get_current_object())
             distributor_geo_coding.delay(current_user.id, current_user.address.id)
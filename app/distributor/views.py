@@ -7,6 +7,7 @@ from app import db
 from app.models import Vendor, Stock, Item
 from app.constants import DISTRIBUTOR_REGISTER
 from app.permission import distributor_permission
+from app.signals import stock_changed
 from app.utils import DataTableHandler
 from app.utils.redis import redis_get
 from . import distributor as distributor_blueprint
@@ -86,9 +87,11 @@ def items_stock():
 @distributor_blueprint.route('/items/datatable')
 @distributor_permission.require(401)
 def items_data_table():
-    def handle_stock(item):
-        stock = Stock.query.filter_by(distributor_id=current_user.id, item_id=item.id).first()
-        return stock.stock if stock else 0
+    stocks = {}
+
+    def load_stocks(items):
+        stocks.update((stock.item_id, stock.stock) for stock in Stock.query.filter(
+            Stock.distributor_id == current_user.id, Stock.item_id.in_([item.id for item in items])))
 
     params = {
         'id': {'orderable': False, 'data': lambda x: x.id},
@@ -97,12 +100,11 @@ def items_data_table():
         'scene_id': {'orderable': False, 'data': lambda x: x.scene},
         'size': {'orderable': False, 'data': lambda x: x.size},
         'price': {'orderable': True, 'order_key': Item.price, 'data': lambda x: x.price},
-        'inventory': {'orderable': False, 'data': handle_stock}
+        'inventory': {'orderable': False, 'data': lambda x: stocks.get(x.id, 0), 'prefetch': load_stocks}
     }
     query = Item.query.filter_by(vendor_id=current_user.vendor.id, is_deleted=False, is_component=False)
     data_table_handler = DataTableHandler(params)
-    data = data_table_handler.query_params(query)
-    return jsonify(data)
+    return data_table_handler.response(query)
 
 
 @distributor_blueprint.route('/items/<int:item_id>', methods=['POST'])
@@ -120,6 +122,7 @@ def item_stock(item_id):
         stock.stock = request.form['stock']
     db.session.add(stock)
     db.session.commit()
+    stock_changed.send(current_app._get_current_object(), item_id=item.id, distributor_id=current_user.id)
     return jsonify({'success': True})
 
 
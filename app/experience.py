@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import json
+from collections import OrderedDict
+
+from flask import current_app
+
+from app import db, local_redis, signals, areas
+from app.models import Distributor, Stock, DistributorAddress
+from app.utils.redis import append_changes, read_changes
+
+EXPERIENCE = 'EXPERIENCE'
+
+# 最近查看的商品的体验馆 {item_id: stores}
+_cache = OrderedDict()
+# 已处理的最后一条失效记录
+sequence = None
+
+
+def experience_stores(rows, area_index):
+    """
+    rows: (item_id, distributor_id, cn_id, ext_number), 有库存的经销商及其地址
+    按 (省, 市, 区) 分组, 返回 {item_id: {省 cn_id: {'area', 'children': {市: {'area', 'children': {区: ...}}}}}}
+    """
+    groups = {}
+    ext_numbers = {}
+    locations = {}
+    for item_id, distributor_id, cn_id, ext_number in rows:
+        if cn_id not in locations:
+            area = area_index.find(cn_id)
+            if area is None or area.level < 2:
+                locations[cn_id] = None
+            else:
+                city = area.father if area.level == 3 else area
+                locations[cn_id] = (city.father, city, area)
+        key = locations[cn_id]
+        if key is None:
+            continue
+        item_groups = groups.get(item_id)
+        if item_groups is None:
+            item_groups = groups[item_id] = {}
+        if key in item_groups:
+            item_groups[key].add(distributor_id)
+        else:
+            item_groups[key] = {distributor_id}
+        ext_numbers[distributor_id] = ext_number
+    stores = {}
+    for item_id, item_groups in groups.items():
+        tree = stores[item_id] = {}
+        for (province, city, district), distributor_ids in item_groups.items():
+            cities = tree.setdefault(province.cn_id, {'area': province.area, 'children': {}})['children']
+            districts = cities.setdefault(city.cn_id, {'area': city.area, 'children': {}})['children']
+            distributor_ids = sorted(distributor_ids)
+            if len(distributor_ids) == 1:
+                names = ['%s体验馆' % district.area]
+            else:
+                names = ['%s体验馆%d' % (district.area, index) for index in range(1, len(distributor_ids) + 1)]
+            districts[district.cn_id] = {'area': district.area, 'distributors': {
+                distributor_id: {'name': name, 'ext_number': ext_numbers[distributor_id]}
+                for distributor_id, name in zip(distributor_ids, names)
+            }}
+    return stores
+
+
+def _stock_rows(*criterion):
+    return db.session.query(Stock.item_id, Stock.distributor_id, DistributorAddress.cn_id, Distributor.ext_number).\
+        filter(Stock.stock > 0, Stock.distributor_id == Distributor.id, Distributor.is_revoked == False,
+               DistributorAddress.distributor_id == Distributor.id, *criterion)
+
+
+def item_stores(item_id):
+    """
+    商品的体验馆, 依次从进程内缓存, redis, 数据库读取
+    """
+    if item_id in _cache:
+        _cache.move_to_end(item_id)
+        return _cache[item_id]
+    key = '%s:ITEM:%d' % (EXPERIENCE, item_id)
+    data = local_redis.get(key)
+    if data is not None:
+        stores = json.loads(data.decode())
+    else:
+        stores = experience_stores(_stock_rows(Stock.item_id == item_id), areas.get_index()).get(item_id, {})
+        # 与 redis 中的格式一致, json 的键都是字符串
+        stores = json.loads(json.dumps(stores))
+        local_redis.set(key, json.dumps(stores), current_app.config['ITEM_STORES_DURATION'])
+    _cache[item_id] = stores
+    while len(_cache) > current_app.config['ITEM_STORES_CACHE_SIZE']:
+        _cache.popitem(last=False)
+    return stores
+
+
+def invalidate(item_ids):
+    """
+    删除 redis 中的缓存并记录失效的商品, 其他进程在下一个请求时从进程内缓存中移除
+    """
+    item_ids = set(item_ids)
+    if not item_ids:
+        return
+    local_redis.delete(*['%s:ITEM:%d' % (EXPERIENCE, item_id) for item_id in item_ids])
+    append_changes(EXPERIENCE, item_ids)
+    for item_id in item_ids:
+        _cache.pop(item_id, None)
+
+
+def sync_stores(latest=None):
+    global sequence
+    if latest is None:
+        latest = int(local_redis.get('%s:SEQUENCE' % EXPERIENCE) or 0)
+    changes = read_changes(EXPERIENCE, sequence, latest) if sequence is not None else None
+    if changes is None:
+        _cache.clear()
+    else:
+        for item_id in changes:
+            _cache.pop(int(item_id), None)
+    sequence = latest
+
+
+def distributor_items(distributor_id):
+    return [stock.item_id for stock in db.session.query(Stock.item_id).filter(Stock.distributor_id == distributor_id)]
+
+
+@signals.stock_changed.connect
+def _on_stock_changed(sender, item_id, distributor_id):
+    invalidate([item_id])
+
+
+@signals.distributor_changed.connect
+def _on_distributor_changed(sender, distributor):
+    invalidate(distributor_items(distributor.id))
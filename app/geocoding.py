@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from flask import current_app
+
+from app import db, local_redis, nearby
+from app.models import Distributor, DistributorAddress
+
+GEOCODE = 'GEOCODE'
+
+
+class BaiduGeocoder(object):
+    """
+    百度地图地理编码和 LBS 云存储. 各接口地址可以配置, 测试时指向本地的模拟服务
+    """
+    def __init__(self, config):
+        self.ak = config['GEOCODER_AK']
+        self.geotable_id = config['GEOTABLE_ID']
+        self.geocoder_url = config['GEOCODER_URL']
+        self.create_poi_url = config['CREATE_POI_URL']
+        self.update_poi_url = config['UPDATE_POI_URL']
+        self.timeout = config['GEOCODER_TIMEOUT']
+        self.session = requests.Session()
+        # 只重试 GET, 创建 poi 不是幂等的
+        retry = Retry(total=config['GEOCODER_RETRIES'], backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['GEOCODER_CONCURRENCY'], max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def geocode(self, address):
+        """
+        返回 (经度, 纬度), 无法解析时返回 None
+        """
+        response = self.session.get(self.geocoder_url, params={'address': address, 'output': 'json', 'ak': self.ak},
+                                    timeout=self.timeout)
+        data = json.loads(response.content.decode('utf8'))
+        if data['status'] != 0:
+            return None
+        return data['result']['location']['lng'], data['result']['location']['lat']
+
+    def save_poi(self, poi_id, distributor_id, title, address, longitude, latitude):
+        """
+        创建或更新 poi, 返回 poi id
+        """
+        data = {
+            'title': title,
+            'address': address,
+            'longitude': longitude,
+            'latitude': latitude,
+            'coord_type': 1,
+            'geotable_id': self.geotable_id,
+            'ak': self.ak,
+            'distributor_id': distributor_id
+        }
+        if not poi_id:
+            response = self.session.post(self.create_poi_url, data=data, timeout=self.timeout)
+            return json.loads(response.content.decode('utf8'))['id']
+        data['id'] = poi_id
+        self.session.post(self.update_poi_url, data=data, timeout=self.timeout)
+        return poi_id
+
+
+backends = {'baidu': BaiduGeocoder}
+_geocoder = None
+
+
+def get_geocoder():
+    """
+    每个进程一个, 复用连接池
+    """
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = backends[current_app.config['GEOCODER_BACKEND']](current_app.config)
+    return _geocoder
+
+
+def normalize(address):
+    return re.sub(r'\s+', '', unicodedata.normalize('NFKC', address))
+
+
+def geocode(address):
+    """
+    相同地址的解析结果缓存在 redis 中, 无法解析的地址不缓存
+    """
+    address = normalize(address)
+    key = '%s:%s' % (GEOCODE, hashlib.md5(address.encode('utf8')).hexdigest())
+    cached = local_redis.get(key)
+    if cached is not None:
+        return tuple(map(float, cached.decode().split(',')))
+    location = get_geocoder().geocode(address)
+    if location is not None:
+        local_redis.set(key, '%r,%r' % location, current_app.config['GEOCODE_DURATION'])
+    return location
+
+
+def _locate(job):
+    """
+    job: (distributor_id, name, address, poi_id), 只访问网络, 可以在线程中执行
+    """
+    distributor_id, name, address, poi_id = job
+    location = geocode(address)
+    if location is None:
+        return distributor_id, None, poi_id
+    poi_id = get_geocoder().save_poi(poi_id, distributor_id, name, address, location[0], location[1])
+    return distributor_id, location, poi_id
+
+
+def _save(distributor_address, location, poi_id):
+    distributor_address.longitude, distributor_address.latitude = location
+    distributor_address.poi_id = poi_id
+
+
+def geo_coding(distributor_id, distributor_address_id):
+    distributor = Distributor.query.get(distributor_id)
+    distributor_address = DistributorAddress.query.get(distributor_address_id)
+    _, location, poi_id = _locate((distributor.id, distributor.name, distributor_address.precise_address(),
+                                   distributor_address.poi_id))
+    if location is None:
+        return False
+    _save(distributor_address, location, poi_id)
+    db.session.commit()
+    nearby.changed(distributor.id)
+    return True
+
+
+def bulk_geo_coding(distributor_ids=None, concurrency=None):
+    """
+    并发解析多个经销商的地址, 数据库只在当前线程读写, 返回解析成功的数量
+    """
+    query = db.session.query(Distributor.id, Distributor.name, DistributorAddress).\
+        filter(DistributorAddress.distributor_id == Distributor.id, Distributor.is_revoked == False)
+    if distributor_ids is not None:
+        query = query.filter(Distributor.id.in_(distributor_ids))
+    addresses = {}
+    jobs = []
+    for distributor_id, name, distributor_address in query:
+        addresses[distributor_id] = distributor_address
+        jobs.append((distributor_id, name, distributor_address.precise_address(), distributor_address.poi_id))
+    app = current_app._get_current_object()
+
+    def locate(job):
+        with app.app_context():
+            try:
+                return _locate(job)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                app.logger.warning('geo coding distributor %d failed: %s' % (job[0], e))
+                return job[0], None, job[3]
+    located_ids = []
+    with ThreadPoolExecutor(max_workers=concurrency or app.config['GEOCODER_CONCURRENCY']) as executor:
+        for distributor_id, location, poi_id in executor.map(locate, jobs):
+            if location is not None:
+                _save(addresses[distributor_id], location, poi_id)
+                located_ids.append(distributor_id)
+    db.session.commit()
+    for distributor_id in located_ids:
+        nearby.changed(distributor_id)
+    return len(located_ids)
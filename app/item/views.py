@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 from math import ceil
-from flask import render_template, request, current_app, abort, jsonify, g
+from flask import render_template, request, current_app, abort, g
 from flask.ext.login import current_user
 from flask.ext.cdn import url_for
 
-from app import statisitc
-from app.models import Item, Category
+from app import statisitc, dictionary, item_detail, search as item_search
+from app.item_index import PRICE_LIST, PRICE_TEXT, get_index, bitmap_count
+from app.suggest import TOP, get_trie
+from app.models import Item
 from app.permission import user_permission
+from app.utils import items_json, encode_cursor, decode_cursor
+from app.utils.conditional import not_modified, conditional
+from app.utils.response import jsonify
 from . import item as item_blueprint
 
 
@@ -15,8 +20,20 @@ def item_list():
     return render_template("user/search.html", user=current_user)
 
 
+def _valid_ids(statistic, ids):
+    return list(statistic['available_set'] & set(ids)) if ids else None
+
+
 @item_blueprint.route("/filter")
 def item_filter():
+    filter_index = get_index()
+    # 后台重建索引期间结果来自旧索引, 不能以当前统计的 ETag 被浏览器和 CDN 缓存
+    current = filter_index.source is statisitc.item_facets and filter_index.generation == statisitc.generation
+    etag = 'filter-%d-%d' % (statisitc.generation, statisitc.modified_time)
+    if current:
+        response = not_modified(etag, statisitc.modified_time)
+        if response is not None:
+            return response
     materials = request.args.getlist('material', type=int)
     styles = request.args.getlist('style', type=int)
     scenes = request.args.getlist('scene', type=int)
@@ -27,73 +44,43 @@ def item_filter():
     search = request.args.get('search', type=str)
 
     page = request.args.get('page', 1, type=int)
-    price_list = ((1, 9999), (10000, 49999), (50000, 99999), (100000, 249999), (250000, 499999), (500000, 2147483647))
-    price_text = ('1万以下', '1万 - 5万', '5万 - 10万', '10万 - 25万', '25万 - 50万', '50万以上')
-
-    query = Item.query.filter(Item.is_deleted == False, Item.is_component == False)
-    if brands:
-        brands = list(
-            statisitc.brands['available_set'] - (statisitc.brands['available_set'] - set(brands))
-        )
-        query = query.filter(Item.vendor_id.in_(brands))
-    else:
-        query = query.filter(Item.vendor_id.in_(statisitc.brands['available_set']))
-    if materials:
-        materials = list(
-            statisitc.materials['available_set'] - (statisitc.materials['available_set'] - set(materials))
-        )
-        query = query.filter(Item.second_material_id.in_(materials))
-    if category is not None:
-        category = Category.query.get(category)
-        category_ids = []
-        if category is not None:
-            if category.level == 3:
-                category_ids = [category.id]
-            elif category.level == 2:
-                children = statisitc.categories['available'][category.father_id]['children'][category.id]['children']
-                if children:
-                    category_ids = children.keys()
-                else:
-                    category_ids = [category.id]
-            else:
-                children = statisitc.categories['available'][category.id]['children']
-                for child in children:
-                    if not children[child]['children']:
-                        category_ids.append(child)
-                    else:
-                        category_ids.extend(children[child]['children'].keys())
-        if category_ids:
-            query = query.filter(Item.category_id.in_(category_ids))
-    if scenes:
-        scenes = list(
-            statisitc.scenes['available_set'] - (statisitc.scenes['available_set'] - set(scenes))
-        )
-        query = query.filter(Item.scene_id.in_(scenes))
-    if styles:
-        styles = list(
-            statisitc.styles['available_set'] - (statisitc.styles['available_set'] - set(styles))
-        )
-        query = query.filter(Item.style_id.in_(styles))
-    if price is not None and 0 <= price < len(price_list):
-        query = query.filter(Item.price >= price_list[price][0], Item.price <= price_list[price][1])
-    else:
+    cursor = decode_cursor(request.args.get('cursor', ''), 3)
+    if cursor is not None and not all(isinstance(value, int) for value in cursor):
+        cursor = None
+    per_page = current_app.config['ITEM_PER_PAGE']
+
+    brands = _valid_ids(statisitc.brands, brands)
+    materials = _valid_ids(statisitc.materials, materials)
+    scenes = _valid_ids(statisitc.scenes, scenes)
+    styles = _valid_ids(statisitc.styles, styles)
+    category_path = statisitc.category_path(category) if category is not None else None
+    category_ids = statisitc.category_leaves(category_path) if category_path else None
+    if price is None or not 0 <= price < len(PRICE_LIST):
         price = None
-    if search is not None and search != '':
-        query = query.filter(Item.item.like('%' + search + '%'))
-    if price_order == 'asc':
-        query = query.order_by(Item.price)
-    elif price_order == 'desc':
-        query = query.order_by(-Item.price)
-    elif price_order is not None:
+    if price_order not in ('asc', 'desc'):
         price_order = None
 
-    items = query.paginate(page, current_app.config['ITEM_PER_PAGE'], False).items
-    per_page = current_app.config['ITEM_PER_PAGE']
-    amount = query.count()
+    search_ids = item_search.search(search) if search else None
+    conditions = filter_index.conditions({'brand': brands, 'material': materials, 'category': category_ids or None,
+                                          'scene': scenes, 'style': styles}, price, search_ids)
+    bitmap = filter_index.intersect(conditions)
+    counts = filter_index.counts(conditions)
+    amount = bitmap_count(bitmap)
+    start = (max(page, 1) - 1) * per_page
+    if search_ids is not None and price_order is None:
+        item_ids = filter_index.ranked_page(bitmap, search_ids, start, per_page)
+    elif cursor is not None and cursor[0] == page:
+        after = filter_index.after(bitmap, cursor[1], cursor[2], reverse=price_order == 'desc')
+        item_ids = filter_index.page(after, 0, per_page, reverse=price_order == 'desc')
+    else:
+        item_ids = filter_index.page(bitmap, start, per_page, reverse=price_order == 'desc')
+    next_cursor = None
+    if len(item_ids) == per_page and (search_ids is None or price_order is not None):
+        next_cursor = encode_cursor(page + 1, filter_index.facets[item_ids[-1]]['price'], item_ids[-1])
     data = {
-        'filters': {'available': {}, 'selected': {}},
+        'filters': {'available': {}, 'selected': {}, 'counts': {}},
         'items': {'amount': amount, 'page': page, 'pages': ceil(amount / per_page), "search": search,
-                  "order": price_order, 'query': []}
+                  "order": price_order, 'cursor': next_cursor, 'query': []}
     }
     if not brands:
         data['filters']['available']['brand'] = statisitc.brands['available']
@@ -103,40 +90,46 @@ def item_filter():
         data['filters']['available']['material'] = statisitc.materials['available']
     else:
         data['filters']['selected']['material'] = statisitc.selected(statisitc.materials['available'], materials)
-    if category is None:
-        first_categories = statisitc.categories['available']
+    first_categories = statisitc.categories['available']
+    if category_path is None:
         data['filters']['available']['category'] = \
             {key: {'category': first_categories[key]['category']} for key in first_categories}
-    elif category.level == 1:
-        data['filters']['selected']['category'] = {category.id: {'category': category.category}}
-        second_categories = statisitc.categories['available'][category.id]['children']
+    elif len(category_path) == 1:
+        first = first_categories[category_path[0]]
+        data['filters']['selected']['category'] = {category_path[0]: {'category': first['category']}}
+        second_categories = first['children']
         data['filters']['available']['category'] = \
             {key: {'category': second_categories[key]['category']} for key in second_categories}
-    elif category.level == 2:
+    elif len(category_path) == 2:
+        first = first_categories[category_path[0]]
+        second = first['children'][category_path[1]]
         data['filters']['selected']['category'] = {
-            category.father_id: {
-                'category': category.father.category,
+            category_path[0]: {
+                'category': first['category'],
                 'children': {
-                    category.id: {
-                        'category': category.category
+                    category_path[1]: {
+                        'category': second['category']
                     }
                 }
             }
         }
-        third_categories = statisitc.categories['available'][category.father_id]['children'][category.id]['children']
+        third_categories = second['children']
         if third_categories:
             data['filters']['available']['category'] = \
                 {key: {'category': third_categories[key]['category']} for key in third_categories}
     else:
+        first = first_categories[category_path[0]]
+        second = first['children'][category_path[1]]
+        third = second['children'][category_path[2]]
         data['filters']['selected']['category'] = {
-            category.father.father_id: {
-                'category': category.father.father.category,
+            category_path[0]: {
+                'category': first['category'],
                 'children': {
-                    category.father.id: {
-                        'category': category.father.category,
+                    category_path[1]: {
+                        'category': second['category'],
                         'children': {
-                            category.id: {
-                                'category': category.category
+                            category_path[2]: {
+                                'category': third['category']
                             }
                         }
                     }
@@ -152,66 +145,75 @@ def item_filter():
     else:
         data['filters']['selected']['style'] = statisitc.selected(statisitc.styles['available'], styles)
     if price is not None:
-        data['filters']['selected']['price'] = {price: {'price': price_text[price]}}
+        data['filters']['selected']['price'] = {price: {'price': PRICE_TEXT[price]}}
     else:
-        data['filters']['available']['price'] = {index: {'price': price_text[index]} for index in range(0, 6)}
-    for item in items:
-        image = item.images.first()
-        image_url = image.url if image else url_for('static', filename='img/user/item_default_img.jpg')
-        data['items']['query'].append({
-            'id': item.id,
-            'item': item.item,
-            'price': item.price,
-            'image_url': image_url,
-            'is_suite': item.is_suite
-        })
-    return jsonify(data)
+        data['filters']['available']['price'] = {index: {'price': PRICE_TEXT[index]} for index in range(0, 6)}
+    for facet in ('brand', 'material', 'scene', 'style', 'price'):
+        data['filters']['counts'][facet] = counts[facet]
+    category_counts = counts['category']
+    data['filters']['counts']['category'] = {
+        key: sum(category_counts.get(leaf, 0) for leaf in statisitc.category_leaves((category_path or []) + [key]))
+        for key in data['filters']['available'].get('category', {})
+    }
+    data['items']['query'] = items_json(item_ids)
+    if not current:
+        response = jsonify(data)
+        response.cache_control.no_store = True
+        return response
+    return conditional(jsonify(data), etag, statisitc.modified_time)
+
+
+@item_blueprint.route("/suggest")
+def suggest():
+    prefix = request.args.get('q', '', type=str)
+    limit = request.args.get('limit', TOP, type=int)
+    return jsonify({'suggestions': get_trie().suggest(prefix, min(max(limit, 1), TOP))})
 
 
 @item_blueprint.route("/<int:item_id>")
 def detail(item_id):
+    format = request.args.get('format', '', type=str)
+    action = request.args.get('action', 'compare', type=str)
+    if format == 'json' and action == 'detail':
+        collected = g.identity.can(user_permission) and current_user.item_collected(item_id)
+        version = item_detail.detail_version(item_id)
+        etag = 'item-%d-%d-%d-%d' % (item_id, version, dictionary.version, collected)
+        response = not_modified(etag, version / 1000.0)
+        if response is not None:
+            return response
+        data = item_detail.detail(item_id, version, collected)
+        if data is None:
+            abort(404)
+        return conditional(jsonify(data), etag, version / 1000.0)
     item = Item.query.get_or_404(item_id)
     if item.is_deleted or item.is_component:
         abort(404)
-    format = request.args.get('format', '', type=str)
-    action = request.args.get('action', 'compare', type=str)
     if format == 'json':
-        if action == 'detail':
-            item_dict = {'item': item.dumps()}
-            if item.id in statisitc.items:
-                item_dict['distributors'] = statisitc.items[item.id]
-            else:
-                item_dict['distributors'] = {}
-            if g.identity.can(user_permission):
-                item_dict['item']['collected'] = current_user.item_collected(item.id)
-            else:
-                item_dict['item']['collected'] = False
-        else:
-            if item.is_suite:
-                return '套件商品无法对比'
-            image = item.images.first()
-            image_url = image.url if image else url_for('static', filename='img/user/item_default_img.jpg')
-            item_dict = {
-                'id': item.id,
-                'item': item.item,
-                'price': item.price,
-                'second_material': item.second_material,
-                'category': item.category,
-                'scene': item.scene,
-                'outside_sand': item.outside_sand,
-                'inside_sand': item.inside_sand,
-                'size': item.size,
-                'area': item.area if item.area else '——',
-                'stove': item.stove,
-                'paint': item.paint,
-                'decoration': item.decoration,
-                'story': item.story,
-                'image_url': image_url,
-                'carve': item.carve,
-                'carve_type': item.carve_type,
-                'tenon': item.tenon,
-                'brand': item.vendor.brand
-            }
+        if item.is_suite:
+            return '套件商品无法对比'
+        image = item.images.first()
+        image_url = image.url if image else url_for('static', filename='img/user/item_default_img.jpg')
+        item_dict = {
+            'id': item.id,
+            'item': item.item,
+            'price': item.price,
+            'second_material': item.second_material,
+            'category': item.category,
+            'scene': item.scene,
+            'outside_sand': item.outside_sand,
+            'inside_sand': item.inside_sand,
+            'size': item.size,
+            'area': item.area if item.area else '——',
+            'stove': item.stove,
+            'paint': item.paint,
+            'decoration': item.decoration,
+            'story': item.story,
+            'image_url': image_url,
+            'carve': item.carve,
+            'carve_type': item.carve_type,
+            'tenon': item.tenon,
+            'brand': item.vendor.brand
+        }
         return jsonify(item_dict)
     return render_template("user/detail.html")
 
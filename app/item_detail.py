@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+from app import db, local_redis, signals, statisitc, experience, dictionary
+from app.models import Item
+from app.utils.redis import local_cached, cache_invalidate
+from app.utils.response import dumps
+
+# 商品详情按 (商品, 版本, 字典表版本) 缓存, 不含用户相关的 collected, 输出时再加上.
+# 修改后版本号变化, 修改前开始的重建即使晚于失效完成也只会写入旧版本的缓存
+DETAIL = 'ITEM_DETAIL'
+VERSIONS = '%s:VERSIONS' % DETAIL
+
+# 版本号是毫秒时间, 同一毫秒内的多次修改也保证递增
+_bump_script = local_redis.register_script("""
+local now = tonumber(ARGV[2])
+local old = tonumber(redis.call('hget', KEYS[1], ARGV[1]) or '0')
+local version = math.max(now, old + 1)
+redis.call('hset', KEYS[1], ARGV[1], version)
+return {old, version}
+""")
+
+
+def _build(item_id):
+    item = Item.query.get(item_id)
+    if item is None or item.is_deleted or item.is_component:
+        return 'null'
+    if statisitc.item_facets is not None and item.id in statisitc.item_facets:
+        distributors = experience.item_stores(item.id)
+    else:
+        distributors = {}
+    return dumps({'item': item.dumps(), 'distributors': distributors})
+
+
+def _key(item_id, version):
+    return '%d:%d:%d' % (item_id, version, dictionary.version)
+
+
+def detail(item_id, version, collected):
+    """
+    version 为 detail_version(item_id), 商品不存在时返回 None
+    """
+    data = json.loads(local_cached(DETAIL, _key(item_id, version), lambda: _build(item_id)))
+    if data is None:
+        return None
+    return {'item': dict(data['item'], collected=bool(collected)), 'distributors': data['distributors']}
+
+
+def detail_version(item_id):
+    """
+    商品详情最后一次失效的时间 (毫秒), 没有失效过时为 0
+    """
+    return int(local_redis.hget(VERSIONS, item_id) or 0)
+
+
+def invalidate_detail(item_id):
+    """
+    增加版本号, 旧版本的缓存不会再被读取, 这里只是提前释放
+    """
+    old, version = _bump_script(keys=[VERSIONS], args=[item_id, int(time.time() * 1000)])
+    cache_invalidate(DETAIL, _key(item_id, old))
+
+
+@signals.item_changed.connect
+def _on_item_changed(sender, item):
+    invalidate_detail(item.suite_id if item.is_component else item.id)
+
+
+@signals.stock_changed.connect
+def _on_stock_changed(sender, item_id, distributor_id):
+    invalidate_detail(item_id)
+
+
+@signals.distributor_changed.connect
+def _on_distributor_changed(sender, distributor):
+    for item_id in experience.distributor_items(distributor.id):
+        invalidate_detail(item_id)
+
+
+@signals.vendor_changed.connect
+def _on_vendor_changed(sender, vendor):
+    """
+    厂家通过审核后其经销商才会出现在商品详情中
+    """
+    item_ids = db.session.query(Item.id).filter(Item.vendor_id == vendor.id, Item.is_deleted == False,
+                                                Item.is_component == False)
+    for item_id, in item_ids:
+        invalidate_detail(item_id)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from app import statisitc
+
+PRICE_LIST = ((1, 9999), (10000, 49999), (50000, 99999), (100000, 249999), (250000, 499999), (500000, 2147483647))
+PRICE_TEXT = ('1万以下', '1万 - 5万', '5万 - 10万', '10万 - 25万', '25万 - 50万', '50万以上')
+INDEX_FACETS = ('brand', 'material', 'category', 'style', 'scene')
+# 变化的商品数不超过该值时在原索引上修改, 否则在后台重建
+INDEX_PATCH_LIMIT = 20
+
+_index = None
+_building = False
+
+
+try:
+    bitmap_count = int.bit_count
+except AttributeError:
+    def bitmap_count(bitmap):
+        return bin(bitmap).count('1')
+
+
+def _bitmap(ordinals, length):
+    data = bytearray((length >> 3) + 1)
+    for ordinal in ordinals:
+        data[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(bytes(data), 'little')
+
+
+def _insert_bit(bitmap, position):
+    """
+    在 position 处插入一个 0, 之后的位后移
+    """
+    low = bitmap & ((1 << position) - 1)
+    return bitmap >> position << (position + 1) | low
+
+
+def _delete_bit(bitmap, position):
+    low = bitmap & ((1 << position) - 1)
+    return bitmap >> (position + 1) << position | low
+
+
+class ItemIndex(object):
+    """
+    商品筛选索引
+
+    商品按 (价格, id) 排序后的位置作为序号, 每个筛选项对应一个整数位图,
+    筛选是位图的与/或运算, 价格区间和价格排序的分页都只是序号区间的切片.
+    source 是建立索引时的 statisitc.item_facets, 统计重新读取后需要重建索引.
+    """
+
+    def __init__(self, item_facets, generation, source=None):
+        self.source = source if source is not None else item_facets
+        self.generation = generation
+        self.facets = dict(item_facets)
+        records = sorted(item_facets.items(), key=lambda record: (record[1]['price'], record[0]))
+        self.ids = [item_id for item_id, facets in records]
+        self.prices = [facets['price'] for item_id, facets in records]
+        self._ordinals = None
+        self.all = (1 << len(self.ids)) - 1
+        ordinals = {facet: {} for facet in INDEX_FACETS}
+        for ordinal, (item_id, facets) in enumerate(records):
+            for facet in INDEX_FACETS:
+                if facets[facet] is not None:
+                    ordinals[facet].setdefault(facets[facet], []).append(ordinal)
+        self.bitmaps = {}
+        for facet in INDEX_FACETS:
+            self.bitmaps[facet] = {value: _bitmap(ordinals[facet][value], len(self.ids))
+                                   for value in ordinals[facet]}
+
+    @property
+    def ordinals(self):
+        if self._ordinals is None:
+            self._ordinals = {item_id: ordinal for ordinal, item_id in enumerate(self.ids)}
+        return self._ordinals
+
+    def _position(self, price, item_id):
+        low = bisect_left(self.prices, price)
+        high = bisect_right(self.prices, price)
+        return bisect_left(self.ids, item_id, low, high)
+
+    def _insert(self, item_id, facets):
+        position = self._position(facets['price'], item_id)
+        self.ids.insert(position, item_id)
+        self.prices.insert(position, facets['price'])
+        for facet in INDEX_FACETS:
+            bitmaps = self.bitmaps[facet]
+            for value in bitmaps:
+                bitmaps[value] = _insert_bit(bitmaps[value], position)
+            if facets[facet] is not None:
+                bitmaps[facets[facet]] = bitmaps.get(facets[facet], 0) | 1 << position
+        self.all = self.all << 1 | 1
+        self.facets[item_id] = facets
+
+    def _remove(self, item_id, facets):
+        position = self._position(facets['price'], item_id)
+        del self.ids[position]
+        del self.prices[position]
+        for facet in INDEX_FACETS:
+            bitmaps = self.bitmaps[facet]
+            for value in bitmaps:
+                bitmaps[value] = _delete_bit(bitmaps[value], position)
+            if facets[facet] is not None and not bitmaps[facets[facet]]:
+                del bitmaps[facets[facet]]
+        self.all >>= 1
+        del self.facets[item_id]
+
+    def update(self, item_id, facets):
+        """
+        facets 为 None 时删除该商品. 价格不变时只修改该商品所在的位, 否则之后的序号都要移动一位
+        """
+        old_facets = self.facets.get(item_id)
+        if old_facets is not None and facets is not None and old_facets['price'] == facets['price']:
+            bit = 1 << self._position(facets['price'], item_id)
+            for facet in INDEX_FACETS:
+                old_value, new_value = old_facets[facet], facets[facet]
+                if old_value == new_value:
+                    continue
+                bitmaps = self.bitmaps[facet]
+                if old_value is not None:
+                    bitmaps[old_value] &= ~bit
+                    if not bitmaps[old_value]:
+                        del bitmaps[old_value]
+                if new_value is not None:
+                    bitmaps[new_value] = bitmaps.get(new_value, 0) | bit
+            self.facets[item_id] = facets
+            return
+        if old_facets is not None:
+            self._remove(item_id, old_facets)
+        if facets is not None:
+            self._insert(item_id, facets)
+        self._ordinals = None
+
+    def union(self, facet, values):
+        bitmap = 0
+        bitmaps = self.bitmaps[facet]
+        for value in values:
+            bitmap |= bitmaps.get(value, 0)
+        return bitmap
+
+    def price_range(self, low, high):
+        start = bisect_left(self.prices, low)
+        stop = bisect_right(self.prices, high)
+        return ((1 << stop) - 1) ^ ((1 << start) - 1)
+
+    def members(self, item_ids):
+        ordinals = self.ordinals
+        return _bitmap([ordinals[item_id] for item_id in item_ids if item_id in ordinals], len(self.ids))
+
+    def conditions(self, filters, price=None, search_ids=None):
+        """
+        filters: {facet: values}, values 为 None 时不筛选该项
+        search_ids: 搜索命中的商品 id
+        返回每个生效筛选条件对应的位图
+        """
+        conditions = {}
+        for facet in filters:
+            if filters[facet] is not None:
+                conditions[facet] = self.union(facet, filters[facet])
+        if price is not None:
+            conditions['price'] = self.price_range(*PRICE_LIST[price])
+        if search_ids is not None:
+            conditions['search'] = self.members(search_ids)
+        return conditions
+
+    def intersect(self, conditions, excluded=None):
+        bitmap = self.all
+        for key in conditions:
+            if key != excluded:
+                bitmap &= conditions[key]
+        return bitmap
+
+    def match(self, filters, price=None, search_ids=None):
+        return self.intersect(self.conditions(filters, price, search_ids))
+
+    def counts(self, conditions):
+        """
+        每个筛选项的各个取值在其他筛选条件下的商品数量, 分类按末级分类统计
+        """
+        counts = {}
+        for facet in INDEX_FACETS:
+            bitmap = self.intersect(conditions, facet)
+            bitmaps = self.bitmaps[facet]
+            counts[facet] = {value: bitmap_count(bitmap & bitmaps[value]) for value in bitmaps}
+        bitmap = self.intersect(conditions, 'price')
+        counts['price'] = {index: bitmap_count(bitmap & self.price_range(*PRICE_LIST[index]))
+                           for index in range(len(PRICE_LIST))}
+        return counts
+
+    def page(self, bitmap, start, length, reverse=False):
+        """
+        按价格从低到高 (reverse 时从高到低) 取第 start 个起的 length 个商品 id
+        """
+        if not reverse:
+            bits = bin(bitmap)[:1:-1]
+            return [self.ids[match.start()] for match in islice(re.finditer('1', bits), start, start + length)]
+        bits = bin(bitmap)[2:]
+        top = len(bits) - 1
+        return [self.ids[top - match.start()] for match in islice(re.finditer('1', bits), start, start + length)]
+
+    def after(self, bitmap, price, item_id, reverse=False):
+        """
+        游标分页: 只保留按价格排序时排在 (price, item_id) 之后的商品
+        """
+        low = bisect_left(self.prices, price)
+        high = bisect_right(self.prices, price)
+        if reverse:
+            return bitmap & ((1 << bisect_left(self.ids, item_id, low, high)) - 1)
+        position = bisect_right(self.ids, item_id, low, high)
+        return bitmap >> position << position
+
+    def ranked_page(self, bitmap, ranked_ids, start, length):
+        """
+        按搜索相关度取第 start 个起的 length 个商品 id
+        """
+        ordinals = self.ordinals
+        matched = (item_id for item_id in ranked_ids if item_id in ordinals and bitmap >> ordinals[item_id] & 1)
+        return list(islice(matched, start, start + length))
+
+
+def _rebuild(item_facets, generation):
+    """
+    在后台线程重建索引, 完成前继续使用原索引
+    """
+    global _building
+    if _building:
+        return
+    _building = True
+    records = dict(item_facets)
+
+    def build():
+        global _index, _building
+        try:
+            _index = ItemIndex(records, generation, item_facets)
+        finally:
+            _building = False
+    threading.Thread(target=build, daemon=True).start()
+
+
+def get_index():
+    """
+    统计的代数变化后按变化的商品修改索引, 变化太多或统计重新读取后在后台重建,
+    重建完成前返回的索引落后于统计, 以索引的 generation 为准
+    """
+    global _index
+    if statisitc.item_facets is None:
+        statisitc.load_statistic()
+    item_facets, generation = statisitc.item_facets, statisitc.generation
+    if _index is None:
+        _index = ItemIndex(item_facets, generation)
+    elif _index.source is not item_facets:
+        _rebuild(item_facets, generation)
+    elif _index.generation != generation:
+        item_ids = statisitc.changed_items(_index.generation)
+        if item_ids is None or len(item_ids) > INDEX_PATCH_LIMIT:
+            _rebuild(item_facets, generation)
+        else:
+            for item_id in item_ids:
+                _index.update(item_id, item_facets.get(item_id))
+            _index.generation = generation
+    return _index
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import smtplib
+import time
+
+from flask import current_app, render_template
+from flask.ext.mail import Message, email_dispatched, sanitize_address, sanitize_addresses
+from jinja2 import escape
+
+from app import local_redis
+from app.utils.redis import queue_pop, queue_done, queue_recover
+
+MAIL = 'MAIL'
+QUEUE = '%s:QUEUE' % MAIL
+# 预渲染模板时 url 的占位符
+URL_PLACEHOLDER = '__WMJ_EMAIL_URL__'
+
+_templates = {}
+_mailer = None
+
+
+def render_email(email_type, template, url):
+    """
+    每种邮件的模板只渲染一次, 之后替换其中的链接
+    """
+    html = _templates.get(email_type)
+    if html is None:
+        html = _templates[email_type] = render_template(template, url=URL_PLACEHOLDER)
+    return html.replace(URL_PLACEHOLDER, escape(url))
+
+
+class SMTPMailer(object):
+    """
+    每个进程保持一个 SMTP 连接, 空闲超过 MAIL_IDLE_TIMEOUT 后重新连接
+    """
+    def __init__(self, config):
+        self.server = config['MAIL_SERVER']
+        self.port = config['MAIL_PORT']
+        self.use_ssl = config.get('MAIL_USE_SSL', False)
+        self.use_tls = config.get('MAIL_USE_TLS', False)
+        self.username = config.get('MAIL_USERNAME')
+        self.password = config.get('MAIL_PASSWORD')
+        self.timeout = config['MAIL_TIMEOUT']
+        self.idle_timeout = config['MAIL_IDLE_TIMEOUT']
+        self.host = None
+        self.used = 0
+
+    def connect(self):
+        if self.use_ssl:
+            host = smtplib.SMTP_SSL(self.server, self.port, timeout=self.timeout)
+        else:
+            host = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        if self.use_tls:
+            host.starttls()
+        if self.username and self.password:
+            host.login(self.username, self.password)
+        return host
+
+    def close(self):
+        if self.host is not None:
+            try:
+                self.host.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.host = None
+
+    def send(self, msg):
+        """
+        连接被服务器关闭时重新连接并重试一次
+        """
+        if self.host is not None and time.time() - self.used > self.idle_timeout:
+            self.close()
+        for retry in (True, False):
+            if self.host is None:
+                self.host = self.connect()
+            try:
+                self.host.sendmail(sanitize_address(msg.sender), list(sanitize_addresses(msg.send_to)),
+                                   msg.as_bytes(), msg.mail_options, msg.rcpt_options)
+                break
+            except smtplib.SMTPServerDisconnected:
+                self.host = None
+                if not retry:
+                    raise
+        self.used = time.time()
+
+
+def get_mailer():
+    global _mailer
+    if _mailer is None:
+        _mailer = SMTPMailer(current_app.config)
+    return _mailer
+
+
+def _dedup_key(entry):
+    payload = json.dumps({field: entry[field] for field in ('to', 'subject', 'html', 'body')}, sort_keys=True)
+    return '%s:DEDUP:%s' % (MAIL, hashlib.md5(payload.encode('utf8')).hexdigest())
+
+
+def enqueue(to, subject, html=None, body=None, queue=QUEUE):
+    """
+    放入发送队列, MAIL_DEDUP_DURATION 内相同的邮件只入队一次.
+    返回是否需要安排一次发送任务
+    """
+    entry = {'to': to, 'subject': subject, 'html': html, 'body': body}
+    if not local_redis.set(_dedup_key(entry), 1, ex=current_app.config['MAIL_DEDUP_DURATION'], nx=True):
+        return False
+    local_redis.rpush(queue, json.dumps(entry, sort_keys=True))
+    return bool(local_redis.set('%s:SCHEDULED' % queue, 1, ex=current_app.config['MAIL_SCHEDULE_TIMEOUT'], nx=True))
+
+
+def _retry(entry, error):
+    """
+    返回需要重试的条目, 超过 MAIL_MAX_RETRIES 次时放弃并删除去重标记, 之后可以重新发送
+    """
+    retries = entry.get('retries', 0)
+    if retries < current_app.config['MAIL_MAX_RETRIES']:
+        current_app.logger.warning('send email to %s failed, will retry: %s' % (', '.join(entry['to']), error))
+        return [json.dumps(dict(entry, retries=retries + 1), sort_keys=True)]
+    current_app.logger.warning('send email to %s dropped after %d retries: %s' %
+                               (', '.join(entry['to']), retries, error))
+    local_redis.delete(_dedup_key(entry))
+    return []
+
+
+def dispatch(queue=QUEUE, mailer=None):
+    """
+    通过同一个连接发送队列中的全部邮件, 返回发送成功的数量.
+    每批发送完才从处理列表中删除, 失败的邮件最多重试 MAIL_MAX_RETRIES 次
+    """
+    local_redis.delete('%s:SCHEDULED' % queue)
+    queue_recover(queue)
+    mailer = mailer or get_mailer()
+    app = current_app._get_current_object()
+    suppress = app.extensions['mail'].suppress
+    sent = 0
+    while True:
+        batch, entries = queue_pop(queue, app.config['MAIL_QUEUE_BATCH'], app.config['MAIL_PROCESSING_TIMEOUT'])
+        if not entries:
+            return sent
+        retries = []
+        for entry in entries:
+            entry = json.loads(entry)
+            msg = Message(entry['subject'], sender=app.config['WMJ_MAIL_SENDER'], recipients=entry['to'],
+                          html=entry['html'], body=entry['body'])
+            if not suppress:
+                try:
+                    mailer.send(msg)
+                except (smtplib.SMTPException, OSError) as e:
+                    retries.extend(_retry(entry, e))
+                    continue
+            email_dispatched.send(msg, app=app)
+            sent += 1
+        queue_done(queue, batch, retries)
@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 import random
-import json
 
 from flask import render_template, current_app, Response, request, abort, jsonify
 
 from app import statisitc
 from app.models import Item, Scene
 from app.utils import items_json
-from app.utils.redis import redis_set, redis_get
+from app.utils.redis import local_cached
+from app.utils.conditional import conditional
+from app.utils.response import dumps
 from app.main.forms import FeedbackForm
 from .import main
 
@@ -19,8 +20,7 @@ def index():
 
 @main.route('/navbar')
 def navbar():
-    data = redis_get('INDEX_NAVBAR', 'ITEMS')
-    if data is None:
+    def build():
         data = {}
         for scene_id in [2, 3, 4, 6]:   # 客厅 书房 卧室 餐厅
             scene = Scene.query.get(scene_id)
@@ -33,17 +33,16 @@ def navbar():
             else:
                 items = current_app.config['ITEMS']['navbars'][str(scene_id)]
             data[scene.id] = {'scene': scene.scene, 'items': items_json(items)}
-        data = json.dumps(data)
-        redis_set('INDEX_NAVBAR', 'ITEMS', data, expire=86400)
-    return Response(data, mimetype='application/json')
+        return dumps(data)
+    data = local_cached('INDEX_NAVBAR', 'ITEMS', build, expire=86400)
+    return conditional(Response(data, mimetype='application/json'))
 
 
 @main.route('/brands')
 def brand_list():
     format = request.args.get('format', '', type=str)
     if format == 'json':
-        data = redis_get('BRAND', 'ITEMS')
-        if data is None:
+        def build():
             brands = statisitc.brands['available']
             data = {vendor_id: {'brand': brands[vendor_id]['brand']} for vendor_id in brands}
             for vendor_id in data:
@@ -54,9 +53,9 @@ def brand_list():
                 else:
                     items = current_app.config['ITEMS']['brands'][str(vendor_id)]
                 data[vendor_id]['items'] = items_json(items)
-            data = json.dumps(data)
-            redis_set('BRAND', 'ITEMS', data, expire=86400)
-        return Response(data, mimetype='application/json')
+            return dumps(data)
+        data = local_cached('BRAND', 'ITEMS', build, expire=86400)
+        return conditional(Response(data, mimetype='application/json'))
     return render_template('user/brands.html')
 
 
@@ -66,8 +65,7 @@ def vendor_detail(vendor_id):
         abort(404)
     format = request.args.get('format', '', type=str)
     if format == 'json':
-        data = redis_get('BRAND_ITEMS', vendor_id)
-        if data is None:
+        def build():
             data = {}
             if current_app.debug:
                 for scene_id in [2, 3, 4, 6]:
@@ -80,13 +78,11 @@ def vendor_detail(vendor_id):
             else:
                 for scene_id in current_app.config['ITEMS']['vendor_detail'][str(vendor_id)].keys():
                     scene = Scene.query.get(scene_id)
-                    items = []
-                    for item_id in current_app.config['ITEMS']['vendor_detail'][str(vendor_id)][scene_id]:
-                        items.append(Item.query.get(item_id))
+                    items = current_app.config['ITEMS']['vendor_detail'][str(vendor_id)][scene_id]
                     data[scene_id] = {'scene': scene.scene, 'items': items_json(items)}
-            data = json.dumps(data)
-            redis_set('BRAND_ITEMS', vendor_id, data, expire=86400)
-        return Response(data, mimetype='application/json')
+            return dumps(data)
+        data = local_cached('BRAND_ITEMS', vendor_id, build, expire=86400)
+        return conditional(Response(data, mimetype='application/json'))
     return render_template('user/brand_detail.html')
 
 
@@ -94,8 +90,7 @@ def vendor_detail(vendor_id):
 def furniture():
     format = request.args.get('format', '', type=str)
     if format == 'json':
-        data = redis_get('STYLE', 'ITEMS')
-        if data is None:
+        def build():
             styles = statisitc.styles['available']
             data = {style_id: {'style': styles[style_id]['style']} for style_id in styles}
             for style_id in data:
@@ -103,13 +98,11 @@ def furniture():
                     item_list = Item.query.filter(Item.style_id == style_id).all()
                     items = [random.SystemRandom().choice(item_list) for _ in range(8)]
                 else:
-                    items = []
-                    for item_id in current_app.config['ITEMS']['furniture'][str(style_id)]:
-                        items.append(Item.query.get(item_id))
+                    items = current_app.config['ITEMS']['furniture'][str(style_id)]
                 data[style_id]['items'] = items_json(items)
-            data = json.dumps(data)
-            redis_set('STYLE', 'ITEMS', data, expire=86400)
-        return Response(data, mimetype='application/json')
+            return dumps(data)
+        data = local_cached('STYLE', 'ITEMS', build, expire=86400)
+        return conditional(Response(data, mimetype='application/json'))
     return render_template('user/furniture.html')
 
 
@@ -6,15 +6,16 @@ import shutil
 import time
 import re
 import random
+from collections import defaultdict
 
 from flask import current_app
 from flask.ext.login import UserMixin
 from flask.ext.cdn import url_for
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from app import db, login_manager
+from app import db, login_manager, dictionary, areas
 from app.constants import *
-from app.utils.redis import redis_get, redis_set
+from app.utils.redis import redis_get, redis_set, cache_invalidate
 from app.permission import privilege_id_prefix, vendor_id_prefix, distributor_id_prefix, user_id_prefix
 
 
@@ -40,6 +41,9 @@ class Property(object):
     """
 
     _flush = {}
+    # 批量读取: {attr: (外键属性名, lambda keys: {外键: 值})}, 见 prefetch
+    _prefetch = {}
+    _prefetched = ()
 
     def flush(self, *attrs):
         for attr in attrs:
@@ -47,11 +51,61 @@ class Property(object):
 
     def get_or_flush(self, attr):
         real_attr = '_%s' % attr
-        if getattr(self, real_attr, None) is None:
+        if getattr(self, real_attr, None) is None and attr not in self._prefetched:
             self.flush(attr)
         return getattr(self, real_attr, None)
 
 
+class Prefetched(list):
+    """
+    批量读取的一对多关系, 与原来的 query 一样支持 first() 和 count()
+    """
+
+    def first(self):
+        return self[0] if self else None
+
+    def count(self):
+        return len(self)
+
+
+def _one(model, column, keys):
+    values = {}
+    for instance in model.query.filter(getattr(model, column).in_(keys)).order_by(model.id):
+        values.setdefault(getattr(instance, column), instance)
+    return values
+
+
+def _many(query, column):
+    values = defaultdict(Prefetched)
+    for instance in query:
+        values[getattr(instance, column)].append(instance)
+    return values
+
+
+def prefetch(instances, *attrs):
+    """
+    批量填充 Property 的关系, 每个关系只查询一次, 'item.vendor' 表示继续填充 item 的 vendor
+
+    prefetch(items, 'vendor', 'images')
+    prefetch(sms_records, 'item.vendor', 'distributor.address')
+    """
+    instances = [instance for instance in instances if instance is not None]
+    if not instances:
+        return instances
+    for attr in attrs:
+        name, _, rest = attr.partition('.')
+        key, load = instances[0]._prefetch[name]
+        loading = [instance for instance in instances if name not in instance._prefetched]
+        values = load({getattr(instance, key) for instance in loading}) if loading else {}
+        for instance in loading:
+            value = getattr(instance, key)
+            setattr(instance, '_%s' % name, values[value] if isinstance(values, defaultdict) else values.get(value))
+            instance._prefetched = set(instance._prefetched) | {name}
+        if rest:
+            prefetch([getattr(instance, '_%s' % name) for instance in instances], rest)
+    return instances
+
+
 class BaseUser(UserMixin):
     # id
     id = db.Column(db.Integer, primary_key=True)
@@ -156,6 +210,9 @@ class Collection(db.Model, Property):
     _flush = {
         'item': lambda x: Item.query.get(x.item_id)
     }
+    _prefetch = {
+        'item': ('item_id', lambda keys: _one(Item, 'id', keys))
+    }
     _item = None
 
     def __init__(self, user_id, item_id):
@@ -186,6 +243,10 @@ class GuideSMS(db.Model, Property):
         'item': lambda x: Item.query.get(x.item_id),
         'distributor': lambda x: Distributor.query.get(x.distributor_id)
     }
+    _prefetch = {
+        'item': ('item_id', lambda keys: _one(Item, 'id', keys)),
+        'distributor': ('distributor_id', lambda keys: _one(Distributor, 'id', keys))
+    }
     _item = None
     _distributor = None
 
@@ -204,6 +265,26 @@ class GuideSMS(db.Model, Property):
         return self.get_or_flush('distributor')
 
 
+class SMSDelivery(db.Model):
+    __tablename__ = 'sms_deliveries'
+    # id
+    id = db.Column(db.Integer, primary_key=True)
+    # 手机号码
+    mobile = db.Column(db.CHAR(11), nullable=False)
+    # 网关返回的状态码, 0 为成功, -1 为请求失败, -2 为压测 (sms_dispatch.BENCHMARK_STATUS)
+    status = db.Column(db.Integer, nullable=False)
+    # 同一请求中的手机号数量
+    batch_size = db.Column(db.Integer, nullable=False)
+    # 入队时间
+    queued = db.Column(db.Integer, nullable=False)
+    # 发送完成时间
+    sent = db.Column(db.Integer, nullable=False)
+    # 入队到发送完成的时间 (毫秒)
+    latency = db.Column(db.Integer, nullable=False)
+    # 网关请求的时间 (毫秒)
+    gateway_latency = db.Column(db.Integer, nullable=False)
+
+
 class Order(db.Model):
     __tablename__ = 'orders'
     # id
@@ -279,6 +360,9 @@ class Vendor(BaseUser, db.Model, Property):
         x.agent_identity_back and x.name and x.license_limit and x.license_image and x.telephone and x.address and \
         x.address.cn_id and x.address.address
     }
+    _prefetch = {
+        'address': ('id', lambda keys: _one(VendorAddress, 'vendor_id', keys))
+    }
     _logo = None
     _address = None
     _info_completed = None
@@ -410,6 +494,11 @@ class Distributor(BaseUser, db.Model, Property):
         'address': lambda x: DistributorAddress.query.filter_by(distributor_id=x.id).limit(1).first(),
         'revocation': lambda x: DistributorRevocation.query.filter_by(distributor_id=x.id).first()
     }
+    _prefetch = {
+        'vendor': ('vendor_id', lambda keys: _one(Vendor, 'id', keys)),
+        'address': ('id', lambda keys: _one(DistributorAddress, 'distributor_id', keys)),
+        'revocation': ('id', lambda keys: _one(DistributorRevocation, 'distributor_id', keys))
+    }
     _vendor = None
     _address = None
     _revocation = None
@@ -513,6 +602,9 @@ class DistributorRevocation(db.Model, Property):
     _flush = {
         'distributor': lambda x: Distributor.query.get(x.distributor_id)
     }
+    _prefetch = {
+        'distributor': ('distributor_id', lambda keys: _one(Distributor, 'id', keys))
+    }
     _distributor = None
 
     @property
@@ -574,22 +666,27 @@ class Item(db.Model, Property):
 
     _flush = {
         'vendor': lambda x: Vendor.query.get(x.vendor_id),
-        'category': lambda x: [category.category if category is not None else '' for category in
-                               (Category.query.get(x.category_id),)][0],
+        'category': lambda x: dictionary.value(Category, x.category_id, 'category', ''),
         'images': lambda x: ItemImage.query.filter_by(item_id=x.id, is_deleted=False).order_by(ItemImage.sort,
                                                                                                ItemImage.created),
         'components': lambda x: Item.query.filter_by(suite_id=x.id, is_deleted=False, is_component=True),
-        'scene': lambda x: Scene.query.get(x.scene_id).scene,
-        'second_material': lambda x: SecondMaterial.query.get(x.second_material_id).second_material,
-        'outside_sand': lambda x: Sand.query.get(x.outside_sand_id).sand,
-        'inside_sand': lambda x: Sand.query.get(x.inside_sand_id).sand if x.inside_sand_id else '——',
-        'stove': lambda x: Stove.query.get(x.stove_id).stove,
-        'paint': lambda x: Paint.query.get(x.paint_id).paint,
-        'decoration': lambda x: Decoration.query.get(x.decoration_id).decoration,
-        'style': lambda x: Style.query.get(x.style_id).style,
-        'carve_type': lambda x: CarveType.query.get(x.carve_type_id).carve_type,
-        'carve': lambda x: [carve.carve for carve in Carve.query.filter(Carve.id.in_(x.get_carve_id()))],
-        'tenon': lambda x: [tenon.tenon for tenon in Tenon.query.filter(Tenon.id.in_(x.get_tenon_id()))]
+        'scene': lambda x: dictionary.value(Scene, x.scene_id, 'scene'),
+        'second_material': lambda x: dictionary.value(SecondMaterial, x.second_material_id, 'second_material'),
+        'outside_sand': lambda x: dictionary.value(Sand, x.outside_sand_id, 'sand'),
+        'inside_sand': lambda x: dictionary.value(Sand, x.inside_sand_id, 'sand') if x.inside_sand_id else '——',
+        'stove': lambda x: dictionary.value(Stove, x.stove_id, 'stove'),
+        'paint': lambda x: dictionary.value(Paint, x.paint_id, 'paint'),
+        'decoration': lambda x: dictionary.value(Decoration, x.decoration_id, 'decoration'),
+        'style': lambda x: dictionary.value(Style, x.style_id, 'style'),
+        'carve_type': lambda x: dictionary.value(CarveType, x.carve_type_id, 'carve_type'),
+        'carve': lambda x: [dictionary.value(Carve, carve_id, 'carve') for carve_id in sorted(x.get_carve_id())],
+        'tenon': lambda x: [dictionary.value(Tenon, tenon_id, 'tenon') for tenon_id in sorted(x.get_tenon_id())]
+    }
+    _prefetch = {
+        'vendor': ('vendor_id', lambda keys: _one(Vendor, 'id', keys)),
+        'images': ('id', lambda keys: _many(ItemImage.query.filter(ItemImage.item_id.in_(keys),
+                                                                   ItemImage.is_deleted == False).
+                                            order_by(ItemImage.sort, ItemImage.created), 'item_id'))
     }
     _vendor = None
     _category = None
@@ -908,6 +1005,9 @@ class ItemImage(db.Model, Property):
         'item': lambda x: Item.query.get(x.item_id),
         'url': lambda x: url_for('static', filename=x.path)
     }
+    _prefetch = {
+        'item': ('item_id', lambda keys: _one(Item, 'id', keys))
+    }
     _item = None
     _url = None
 
@@ -1093,7 +1193,7 @@ class Area(db.Model, Property):
     distributor_amount = db.Column(db.Integer, nullable=False)
 
     _flush = {
-        'father': lambda x: Area.query.get(x.id) if x.level > 1 else None
+        'father': lambda x: Area.query.get(x.father_id) if x.level > 1 else None
     }
     _father = None
 
@@ -1105,51 +1205,23 @@ class Area(db.Model, Property):
         db.session.commit()
 
     def area_address(self):
-        areas = []
-        area = self
-        while area is not None:
-            if area.area not in ['北京市', '上海市', '天津市', '重庆市']:
-                areas.append(area.area)
-            area = Area.query.get(area.father_id)
-        areas.reverse()
-        return ''.join(areas)
+        return areas.get_area(self.id).area_address()
 
     def grade(self):
-        grades = []
-        area = self
-        while area is not None:
-            grades.append(area)
-            area = Area.query.get(area.father_id)
-        grades.reverse()
-        return grades
+        return areas.get_area(self.id).grade()
 
     @property
     def father(self):
         return self.get_or_flush('father')
 
     def children(self):
-        if self.level < 3:
-            return Area.query.filter_by(father_id=self.id).all()
-        return []
+        return areas.get_area(self.id).children()
 
     def city(self):
-        if self.level == 2:
-            return self
-        return self.father
+        return areas.get_area(self.id).city()
 
     def experience_dict(self, distributor_id):
-        if self.level == 3:
-            third_area = self
-            second_area = self.father
-            first_area = second_area.father
-        else:
-            third_area = second_area = self
-            first_area = second_area.father
-        return {first_area.cn_id: {'area': first_area.area, 'children': {
-            second_area.cn_id: {'area': second_area.area, 'children': {
-                third_area.cn_id: {'area': third_area.area, 'distributors': [distributor_id]}
-            }}
-        }}}
+        return areas.get_area(self.id).experience_dict(distributor_id)
 
 
 class Address(Property):
@@ -1162,14 +1234,9 @@ class Address(Property):
     # 百度地图poi id
     poi_id = db.Column(db.Integer, default=0, nullable=False)
 
-    _flush = {
-        'area': lambda x: Area.query.filter_by(cn_id=x.cn_id).limit(1).first()
-    }
-    _area = None
-
     @property
     def area(self):
-        return self.get_or_flush('area')
+        return areas.find_area(self.cn_id)
 
     def vague_address(self):
         return self.area.area_address() if self.area else ''
@@ -1207,15 +1274,41 @@ class DistributorAddress(Address, db.Model):
     def distributor(self):
         return Distributor.query.get(self.distributor_id)
 
-    def update_distributor_amount(self):
-        city = self.area.city()
-        districts = city.children()
-        cn_ids = [district.cn_id for district in districts]
-        cn_ids.append(city.cn_id)
-        city.distributor_amount = DistributorAddress.query.filter(DistributorAddress.cn_id.in_(cn_ids),
-                                                                  Distributor.id == DistributorAddress.distributor_id,
-                                                                  Distributor.is_revoked == False).count()
+    def change_distributor_amount(self, delta, cn_id=None):
+        """
+        经销商注册, 迁出或迁入, 解约时原子地增减所在城市的经销商数量
+        """
+        area = areas.find_area(self.cn_id if cn_id is None else cn_id)
+        if area is None or area.level < 2:
+            return
+        Area.query.filter_by(id=area.city().id).\
+            update({'distributor_amount': Area.distributor_amount + delta}, synchronize_session=False)
         db.session.commit()
+        cache_invalidate('CITY', 'ALL')
+
+    @staticmethod
+    def reconcile_distributor_amount():
+        """
+        按经销商地址重新统计每个城市的经销商数量, 返回被修正的城市 {城市 id: (原数量, 新数量)}
+        """
+        area_index = areas.get_index()
+        amounts = {}
+        query = db.session.query(DistributorAddress.cn_id, db.func.count(DistributorAddress.id)).\
+            filter(Distributor.id == DistributorAddress.distributor_id, Distributor.is_revoked == False).\
+            group_by(DistributorAddress.cn_id)
+        for cn_id, amount in query:
+            area = area_index.find(cn_id)
+            if area is not None and area.level >= 2:
+                amounts[area.city().id] = amounts.get(area.city().id, 0) + amount
+        changed = {}
+        for city_id, amount in db.session.query(Area.id, Area.distributor_amount).filter(Area.level == 2):
+            if amount != amounts.get(city_id, 0):
+                changed[city_id] = (amount, amounts.get(city_id, 0))
+                Area.query.filter_by(id=city_id).update({'distributor_amount': amounts.get(city_id, 0)})
+        db.session.commit()
+        if changed:
+            cache_invalidate('CITY', 'ALL')
+        return changed
 
 
 class Stove(db.Model):
@@ -1351,3 +1444,6 @@ def generate_fake_data(num=100):
     Area.generate_fake()
     # Vendor.generate_fake()
     # Privilege.generate_fake()
+
+
+dictionary.register(Style, Scene, Stove, Sand, Paint, Decoration, CarveType, Carve, Tenon, SecondMaterial, Category)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import heapq
+import math
+from collections import namedtuple
+
+from app import db, local_redis, signals, areas
+from app.models import Distributor, DistributorAddress, Stock
+from app.utils.redis import append_changes, read_changes
+
+NEARBY = 'NEARBY'
+# 网格边长 (度), 约 55 公里
+CELL = 0.5
+EARTH_RADIUS = 6371.0
+DEGREE = math.pi * EARTH_RADIUS / 180
+
+NearbyStore = namedtuple('NearbyStore', ('id', 'name', 'address', 'ext_number', 'cn_id', 'longitude', 'latitude'))
+
+_index = None
+# 已处理的最后一条变化记录
+sequence = None
+
+
+def distance(lng1, lat1, lng2, lat2):
+    """
+    球面距离, 公里
+    """
+    lng1, lat1, lng2, lat2 = map(math.radians, (lng1, lat1, lng2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell(lng, lat):
+    return int(math.floor(lng / CELL)), int(math.floor(lat / CELL))
+
+
+class NearbyIndex(object):
+    """
+    有库存且已定位的经销商按经纬度放入网格, 从所在网格一圈圈向外找最近的 k 个
+    """
+    def __init__(self):
+        self.stores = {}
+        self.items = {}
+        self.item_stores = {}
+        self.cells = {}
+        self._bounds = None
+
+    def add(self, store, item_ids):
+        self.remove(store.id)
+        if not item_ids or (store.longitude == 0 and store.latitude == 0):
+            return
+        self.stores[store.id] = store
+        self.items[store.id] = set(item_ids)
+        for item_id in item_ids:
+            self.item_stores.setdefault(item_id, set()).add(store.id)
+        self.cells.setdefault(_cell(store.longitude, store.latitude), set()).add(store.id)
+        self._bounds = None
+
+    def remove(self, distributor_id):
+        store = self.stores.pop(distributor_id, None)
+        if store is None:
+            return
+        for item_id in self.items.pop(distributor_id):
+            self.item_stores[item_id].discard(distributor_id)
+            if not self.item_stores[item_id]:
+                del self.item_stores[item_id]
+        cell = _cell(store.longitude, store.latitude)
+        self.cells[cell].discard(distributor_id)
+        if not self.cells[cell]:
+            del self.cells[cell]
+        self._bounds = None
+
+    def bounds(self):
+        """
+        所有网格的范围 (min_x, min_y, max_x, max_y)
+        """
+        if self._bounds is None:
+            xs = [x for x, y in self.cells]
+            ys = [y for x, y in self.cells]
+            self._bounds = min(xs), min(ys), max(xs), max(ys)
+        return self._bounds
+
+    def _ring(self, x, y, radius):
+        if radius == 0:
+            return [(x, y)]
+        cells = [(x + dx, y + dy) for dx in range(-radius, radius + 1) for dy in (-radius, radius)]
+        cells.extend((x + dx, y + dy) for dx in (-radius, radius) for dy in range(-radius + 1, radius))
+        return cells
+
+    def nearest(self, lng, lat, k, item_id=None):
+        """
+        返回 [(距离, 经销商)], 由近到远
+        """
+        if item_id is not None:
+            candidates = (self.stores[distributor_id] for distributor_id in self.item_stores.get(item_id, ()))
+            return heapq.nsmallest(k, ((distance(lng, lat, store.longitude, store.latitude), store)
+                                       for store in candidates), key=lambda result: result[0])
+        if not self.stores:
+            return []
+        x, y = _cell(lng, lat)
+        min_x, min_y, max_x, max_y = self.bounds()
+        # 超过 reach 圈后所有网格都已找过
+        reach = max(x - min_x, max_x - x, y - min_y, max_y - y)
+        found = []
+        visited = 0
+        for radius in range(reach + 1):
+            # 要找的网格比经销商还多时 (如远离所有经销商) 直接逐个计算
+            if (2 * radius + 1) ** 2 > len(self.stores):
+                return heapq.nsmallest(k, ((distance(lng, lat, store.longitude, store.latitude), store)
+                                           for store in self.stores.values()), key=lambda result: result[0])
+            for cell in self._ring(x, y, radius):
+                for distributor_id in self.cells.get(cell, ()):
+                    store = self.stores[distributor_id]
+                    found.append((distance(lng, lat, store.longitude, store.latitude), store))
+                    visited += 1
+            found = heapq.nsmallest(k, found, key=lambda result: result[0])
+            # 圈外的点与中心的经度或纬度至少相差 radius 个网格
+            bound = radius * CELL * DEGREE * math.cos(math.radians(min(89.0, abs(lat) + (radius + 1) * CELL)))
+            if visited == len(self.stores) or len(found) >= k and found[-1][0] <= bound:
+                break
+        return found
+
+    def center(self, cn_ids):
+        """
+        地区内经销商的平均位置, 没有经销商时返回 None
+        """
+        stores = [store for store in self.stores.values() if store.cn_id in cn_ids]
+        if not stores:
+            return None
+        return sum(store.longitude for store in stores) / len(stores), \
+            sum(store.latitude for store in stores) / len(stores)
+
+
+def _load(index, distributor_ids=None):
+    query = db.session.query(Distributor.id, Distributor.name, DistributorAddress.address, Distributor.ext_number,
+                             DistributorAddress.cn_id, DistributorAddress.longitude, DistributorAddress.latitude).\
+        filter(DistributorAddress.distributor_id == Distributor.id, Distributor.is_revoked == False)
+    stock_query = db.session.query(Stock.distributor_id, Stock.item_id).filter(Stock.stock > 0)
+    if distributor_ids is not None:
+        query = query.filter(Distributor.id.in_(distributor_ids))
+        stock_query = stock_query.filter(Stock.distributor_id.in_(distributor_ids))
+    items = {}
+    for distributor_id, item_id in stock_query:
+        items.setdefault(distributor_id, []).append(item_id)
+    area_index = areas.get_index()
+    for distributor_id in distributor_ids or ():
+        index.remove(distributor_id)
+    for row in query:
+        area = area_index.find(row.cn_id)
+        address = '%s%s' % (area.area_address() if area else '', row.address)
+        store = NearbyStore(row.id, row.name, address, row.ext_number, row.cn_id, row.longitude, row.latitude)
+        index.add(store, items.get(row.id))
+
+
+def get_index():
+    global _index, sequence
+    if _index is None:
+        sequence = int(local_redis.get('%s:SEQUENCE' % NEARBY) or 0)
+        index = NearbyIndex()
+        _load(index)
+        _index = index
+    return _index
+
+
+def changed(distributor_id):
+    """
+    经销商的位置, 库存或状态变化后调用, 各进程在下一个请求时重新读取该经销商
+    """
+    append_changes(NEARBY, [distributor_id])
+
+
+def sync_nearby(latest=None):
+    global _index, sequence
+    if _index is None:
+        return
+    if latest is None:
+        latest = int(local_redis.get('%s:SEQUENCE' % NEARBY) or 0)
+    if latest == sequence:
+        return
+    changes = read_changes(NEARBY, sequence, latest)
+    if changes is None:
+        _index = None
+        return
+    _load(_index, {int(distributor_id) for distributor_id in changes})
+    sequence = latest
+
+
+def area_cn_ids(cn_id):
+    area = areas.find_area(cn_id)
+    if area is None:
+        return set()
+    cn_ids = set()
+    nodes = [area]
+    while nodes:
+        node = nodes.pop()
+        cn_ids.add(node.cn_id)
+        nodes.extend(node.children())
+    return cn_ids
+
+
+@signals.stock_changed.connect
+def _on_stock_changed(sender, item_id, distributor_id):
+    changed(distributor_id)
+
+
+@signals.distributor_changed.connect
+def _on_distributor_changed(sender, distributor):
+    changed(distributor.id)
@@ -4,8 +4,9 @@ from math import ceil
 
 from flask import redirect, render_template, url_for, request
 
-from app.models import GuideSMS
+from app.models import GuideSMS, prefetch
 from app.permission import privilege_permission
+from app.utils import encode_cursor, decode_cursor, seek
 from app.privilege.forms import LoginForm
 from . import operation
 
@@ -22,8 +23,15 @@ def login():
 @privilege_permission.require(404)
 def index():
     page = request.args.get('page', 1, type=int)
-    sms_records = GuideSMS.query.order_by(GuideSMS.created).paginate(page, 50, False).items
+    cursor = decode_cursor(request.args.get('cursor', ''), 3)
+    query = GuideSMS.query.order_by(GuideSMS.created, GuideSMS.id)
+    if cursor is not None and cursor[0] == page:
+        query = seek(query, GuideSMS.created, cursor[1], GuideSMS.id, cursor[2])
+    else:
+        query = query.offset((max(page, 1) - 1) * 50)
+    sms_records = prefetch(query.limit(50).all(), 'item.vendor', 'distributor.address')
     pages = ceil(GuideSMS.query.count() / 50.0)
+    next_cursor = encode_cursor(page + 1, sms_records[-1].created, sms_records[-1].id) if len(sms_records) == 50 else ''
     records = []
     for sms_record in sms_records:
         records.append({
@@ -37,4 +45,4 @@ def index():
             'created': datetime.datetime.fromtimestamp(sms_record.created).strftime('%F %T'),
             'item_url': url_for('item.detail', item_id=sms_record.item.id)
         })
-    return render_template('operation/index.html', records=records, pages=pages, page=page)
+    return render_template('operation/index.html', records=records, pages=pages, page=page, cursor=next_cursor)
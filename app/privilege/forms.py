@@ -12,6 +12,7 @@ from app import db
 from app.constants import VENDOR_REMINDS_SUCCESS, VENDOR_REMINDS_REJECTED
 from app.forms import Form
 from app.models import Vendor, DistributorRevocation, Privilege
+from app.signals import vendor_changed, distributor_changed
 from app.sms import sms_generator, VENDOR_ACCEPT_TEMPLATE
 from app.vendor.forms import ItemForm as BaseItemForm, SuiteForm as BaseSuiteForm
 
@@ -68,6 +69,7 @@ class VendorConfirmForm(Form):
         sms_generator(VENDOR_ACCEPT_TEMPLATE, self.vendor.mobile)
         db.session.add(self.vendor)
         db.session.commit()
+        vendor_changed.send(current_app._get_current_object(), vendor=self.vendor)
 
 
 class VendorConfirmRejectForm(VendorConfirmForm):
@@ -98,11 +100,15 @@ class DistributorRevocationForm(Form):
     def revoke(self):
         if self.revocation_confirm.data:
             self.distributor_revocation.is_revoked = True
-            self.distributor_revocation.distributor.is_deleted = True
+            self.distributor_revocation.distributor.is_revoked = True
             db.session.add(self.distributor_revocation.distributor)
         self.distributor_revocation.pending = False
         db.session.add(self.distributor_revocation)
         db.session.commit()
+        if self.revocation_confirm.data:
+            self.distributor_revocation.distributor.address.change_distributor_amount(-1)
+            distributor_changed.send(current_app._get_current_object(),
+                                     distributor=self.distributor_revocation.distributor)
 
 
 class ItemForm(BaseItemForm):
@@ -8,7 +8,7 @@ from flask.ext.principal import identity_changed, AnonymousIdentity
 from app.constants import ACCESS_GRANTED
 from app.models import Vendor, DistributorRevocation, Item, Distributor
 from app.permission import privilege_permission
-from app.utils import data_table_params, DataTableHandler
+from app.utils import DataTableHandler
 from app.vendor.forms import ComponentForm
 from . import privilege as privilege_blueprint
 from .forms import LoginForm, VendorDetailForm, VendorConfirmForm, VendorConfirmRejectForm, DistributorRevocationForm,\
@@ -59,15 +59,14 @@ def items_data_table():
     params = {
         'id': {'orderable': False, 'data': lambda x: x.id},
         'item': {'orderable': False, 'data': lambda x: x.item},
-        'vendor': {'orderable': False, 'data': lambda x: x.vendor.name},
+        'vendor': {'orderable': False, 'data': lambda x: x.vendor.name, 'prefetch': 'vendor'},
         'scene_id': {'orderable': False, 'data': lambda x: x.scene},
         'price': {'orderable': True, 'order_key': Item.price, 'data': lambda x: x.price},
         'size': {'orderable': False, 'data': lambda x: x.size}
     }
     data_table_handler = DataTableHandler(params)
     query = Item.query.filter_by(is_deleted=False, is_component=False)
-    data = data_table_handler.query_params(query)
-    return jsonify(data)
+    return data_table_handler.response(query)
 
 
 @privilege_blueprint.route('/items/<int:item_id>')
@@ -108,15 +107,14 @@ def vendors_data_table():
     params = {
         'id': {'orderable': False, 'data': lambda x: x.id},
         'name': {'orderable': False, 'data': lambda x: x.name},
-        'address': {'orderable': False, 'data': lambda x: x.address.precise_address()},
+        'address': {'orderable': False, 'data': lambda x: x.address.precise_address(), 'prefetch': 'address'},
         'license_limit': {'orderable': False, 'data': lambda x: x.license_limit},
         'mobile': {'orderable': False, 'data': lambda x: x.mobile},
         'telephone': {'orderable': False, 'data': lambda x: x.telephone}
     }
     data_table_handler = DataTableHandler(params)
     query = Vendor.query.filter_by(confirmed=True)
-    data = data_table_handler.query_params(query)
-    return jsonify(data)
+    return data_table_handler.response(query)
 
 
 @privilege_blueprint.route('/vendors/<int:vendor_id>')
@@ -137,20 +135,24 @@ def vendor_confirm():
 @privilege_blueprint.route('/vendors/confirm/datatable')
 @privilege_permission.require(404)
 def vendors_confirm_data_table():
-    draw, start, length = data_table_params()
-    vendors = Vendor.query.filter_by(confirmed=False, rejected=False).offset(start).limit(length)
-    count = Vendor.query.filter_by(confirmed=False, rejected=False).count()
-    data = {'draw': draw, 'recordsTotal': count, 'recordsFiltered': count, 'data': []}
-    for vendor in vendors:
-        data['data'].append({
-            'id': vendor.id, 'name': vendor.name, 'address': vendor.address.precise_address(), 'email': vendor.email,
-            'license_limit': vendor.license_limit, 'mobile': vendor.mobile, 'telephone': vendor.telephone,
-            'agent_name': vendor.agent_name, 'agent_identity': vendor.agent_identity,
-            'agent_identity_front': url_for('static', filename=vendor.agent_identity_front),
-            'agent_identity_back': url_for('static', filename=vendor.agent_identity_back),
-            'license_image': url_for('static', filename=vendor.license_image)
-        })
-    return jsonify(data)
+    params = {
+        'id': {'orderable': False, 'data': lambda x: x.id},
+        'name': {'orderable': False, 'data': lambda x: x.name},
+        'address': {'orderable': False, 'data': lambda x: x.address.precise_address(), 'prefetch': 'address'},
+        'email': {'orderable': False, 'data': lambda x: x.email},
+        'license_limit': {'orderable': False, 'data': lambda x: x.license_limit},
+        'mobile': {'orderable': False, 'data': lambda x: x.mobile},
+        'telephone': {'orderable': False, 'data': lambda x: x.telephone},
+        'agent_name': {'orderable': False, 'data': lambda x: x.agent_name},
+        'agent_identity': {'orderable': False, 'data': lambda x: x.agent_identity},
+        'agent_identity_front': {'orderable': False,
+                                 'data': lambda x: url_for('static', filename=x.agent_identity_front)},
+        'agent_identity_back': {'orderable': False, 'data': lambda x: url_for('static', filename=x.agent_identity_back)},
+        'license_image': {'orderable': False, 'data': lambda x: url_for('static', filename=x.license_image)}
+    }
+    data_table_handler = DataTableHandler(params)
+    query = Vendor.query.filter_by(confirmed=False, rejected=False)
+    return data_table_handler.response(query)
 
 
 @privilege_blueprint.route('/vendor_confirm/reject', methods=['POST'])
@@ -182,17 +184,19 @@ def distributor_list():
 @privilege_blueprint.route('/distributors/datatable')
 @privilege_permission.require(404)
 def distributors_data_table():
-    draw, start, length = data_table_params()
-    distributors = Distributor.query.filter_by(is_revoked=False).offset(start).limit(length)
-    count = Distributor.query.filter_by(is_revoked=False).count()
-    data = {'draw': draw, 'recordsTotal': count, 'recordsFiltered': count, 'data': []}
-    for distributor in distributors:
-        created = datetime.datetime.fromtimestamp(distributor.created).strftime('%F')
-        data['data'].append({
-            'id': distributor.id, 'name': distributor.name, 'contact_mobile': distributor.contact_mobile,
-            'created': created, 'contact_telephone': distributor.contact_telephone, 'contact': distributor.contact,
-            'revocation_state': distributor.revocation_state, 'address': distributor.address.precise_address()})
-    return jsonify(data)
+    params = {
+        'id': {'orderable': False, 'data': lambda x: x.id},
+        'name': {'orderable': False, 'data': lambda x: x.name},
+        'contact_mobile': {'orderable': False, 'data': lambda x: x.contact_mobile},
+        'created': {'orderable': False, 'data': lambda x: datetime.datetime.fromtimestamp(x.created).strftime('%F')},
+        'contact_telephone': {'orderable': False, 'data': lambda x: x.contact_telephone},
+        'contact': {'orderable': False, 'data': lambda x: x.contact},
+        'revocation_state': {'orderable': False, 'data': lambda x: x.revocation_state, 'prefetch': 'revocation'},
+        'address': {'orderable': False, 'data': lambda x: x.address.precise_address(), 'prefetch': 'address'}
+    }
+    data_table_handler = DataTableHandler(params)
+    query = Distributor.query.filter_by(is_revoked=False)
+    return data_table_handler.response(query)
 
 
 @privilege_blueprint.route('/distributors/revocation', methods=['POST'])
@@ -208,17 +212,17 @@ def distributors_revocation():
 @privilege_blueprint.route('/distributors/revocation/datatable')
 @privilege_permission.require(404)
 def distributors_revocation_data_table():
-    draw, start, length = data_table_params()
-    revocations = DistributorRevocation.query.filter_by(pending=True).offset(start).limit(length)
-    count = DistributorRevocation.query.filter_by(is_revoked=False).count()
-    data = {'draw': draw, 'recordsTotal': count, 'recordsFiltered': count, 'data': []}
-    for revocation in revocations:
-        data['data'].append({
-            'id': revocation.id, 'name': revocation.distributor.name,
-            'address': revocation.distributor.address.precise_address(),
-            'contact': revocation.distributor.contact,
-            'contact_telephone': revocation.distributor.contact_telephone,
-            'contact_mobile': revocation.distributor.contact_mobile,
-            'contract': url_for('static', filename=revocation.contract),
-            'vendor': revocation.distributor.vendor.name})
-    return jsonify(data)
+    params = {
+        'id': {'orderable': False, 'data': lambda x: x.id},
+        'name': {'orderable': False, 'data': lambda x: x.distributor.name, 'prefetch': 'distributor'},
+        'address': {'orderable': False, 'data': lambda x: x.distributor.address.precise_address(),
+                    'prefetch': 'distributor.address'},
+        'contact': {'orderable': False, 'data': lambda x: x.distributor.contact},
+        'contact_telephone': {'orderable': False, 'data': lambda x: x.distributor.contact_telephone},
+        'contact_mobile': {'orderable': False, 'data': lambda x: x.distributor.contact_mobile},
+        'contract': {'orderable': False, 'data': lambda x: url_for('static', filename=x.contract)},
+        'vendor': {'orderable': False, 'data': lambda x: x.distributor.vendor.name, 'prefetch': 'distributor.vendor'}
+    }
+    data_table_handler = DataTableHandler(params)
+    query = DistributorRevocation.query.filter_by(pending=True)
+    return data_table_handler.response(query)
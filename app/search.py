@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import re
+
+from flask import current_app
+
+from app import db, local_redis, signals, dictionary
+from app.models import Item, Vendor, Category, SecondMaterial, Style
+from app.utils.redis import append_changes, read_changes
+
+try:
+    from pypinyin import lazy_pinyin, NORMAL, FIRST_LETTER
+except ImportError:
+    lazy_pinyin = None
+
+SEARCH = 'SEARCH'
+# 字段权重, 商品名命中排在品牌, 分类, 材料之前
+FIELD_WEIGHTS = {'item': 8, 'brand': 4, 'category': 3, 'material': 3, 'style': 2, 'story': 1}
+PINYIN_FIELDS = ('item', 'brand', 'category', 'material', 'style')
+STORY_LENGTH = 500
+
+_index = None
+
+
+def _chars(text):
+    return [char for char in text.lower() if not char.isspace()]
+
+
+def grams(text):
+    """
+    单字和相邻两字, 中文不分词也能按任意子串检索
+    """
+    chars = _chars(text)
+    tokens = set(chars)
+    tokens.update(a + b for a, b in zip(chars, chars[1:]))
+    return tokens
+
+
+def query_grams(text):
+    chars = _chars(text)
+    if len(chars) == 1:
+        return set(chars)
+    return {a + b for a, b in zip(chars, chars[1:])}
+
+
+def pinyin(text):
+    """
+    返回 (全拼, 首字母), 没有安装 pypinyin 时返回 None
+    """
+    if lazy_pinyin is None or not text:
+        return None
+    full = ''.join(lazy_pinyin(text, style=NORMAL)).lower()
+    initials = ''.join(lazy_pinyin(text, style=FIRST_LETTER)).lower()
+    return re.sub(r'\s', '', full), re.sub(r'\s', '', initials)
+
+
+class SearchIndex(object):
+    """
+    商品搜索倒排索引
+
+    postings: {token: {item_id: weight}}, 拼音 token 以 '#' 开头.
+    sequence 是已应用的最后一条变更序号, 与 redis 中的变更记录比较后增量更新.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.tokens = {}
+        self.names = {}
+        self.pinyins = {}
+        self.sequence = 0
+
+    def _add_token(self, token, item_id, weight):
+        posting = self.postings.setdefault(token, {})
+        posting[item_id] = posting.get(item_id, 0) + weight
+
+    def add(self, item_id, fields):
+        self.remove(item_id)
+        tokens = set()
+        pinyins = []
+        for field in FIELD_WEIGHTS:
+            text = fields.get(field) or ''
+            if field == 'story':
+                text = text[:STORY_LENGTH]
+            for token in grams(text):
+                self._add_token(token, item_id, FIELD_WEIGHTS[field])
+                tokens.add(token)
+            if field in PINYIN_FIELDS:
+                result = pinyin(text)
+                if result is None:
+                    continue
+                pinyins.extend(result)
+                for token in grams(result[0]) | grams(result[1]):
+                    self._add_token('#' + token, item_id, FIELD_WEIGHTS[field])
+                    tokens.add('#' + token)
+        self.tokens[item_id] = tokens
+        self.names[item_id] = fields.get('item') or ''
+        self.pinyins[item_id] = pinyins
+
+    def remove(self, item_id):
+        for token in self.tokens.pop(item_id, ()):
+            posting = self.postings[token]
+            posting.pop(item_id, None)
+            if not posting:
+                del self.postings[token]
+        self.names.pop(item_id, None)
+        self.pinyins.pop(item_id, None)
+
+    def _match(self, tokens):
+        postings = [self.postings.get(token, {}) for token in tokens]
+        if not postings:
+            return {}
+        postings.sort(key=len)
+        scores = {}
+        for item_id in postings[0]:
+            score = 0
+            for posting in postings:
+                if item_id not in posting:
+                    break
+                score += posting[item_id]
+            else:
+                scores[item_id] = score
+        return scores
+
+    def search(self, keyword):
+        """
+        返回按相关度从高到低排序的商品 id
+        """
+        keyword = keyword.strip().lower()
+        if not keyword:
+            return []
+        scores = self._match(query_grams(keyword))
+        compact = re.sub(r'\s', '', keyword)
+        if re.match(r'^[a-z]+$', compact):
+            pinyin_scores = self._match({'#' + token for token in query_grams(compact)})
+            for item_id in pinyin_scores:
+                if any(compact in text for text in self.pinyins[item_id]):
+                    scores[item_id] = scores.get(item_id, 0) + pinyin_scores[item_id]
+        for item_id in scores:
+            if keyword in self.names[item_id].lower():
+                scores[item_id] += FIELD_WEIGHTS['item'] * len(keyword)
+        return sorted(scores, key=lambda item_id: (-scores[item_id], item_id))
+
+
+class _Names(object):
+    """
+    分类, 材料, 风格名称取自字典表. 品牌名称在新建时读取, vendor_ids 为 None 时读取全部厂家
+    """
+
+    def __init__(self, vendor_ids=None):
+        query = db.session.query(Vendor.id, Vendor.brand)
+        if vendor_ids is not None:
+            query = query.filter(Vendor.id.in_(vendor_ids))
+        self.brands = dict(query)
+
+    def fields(self, item):
+        return {
+            'item': item.item,
+            'story': item.story,
+            'brand': self.brands.get(item.vendor_id, ''),
+            'category': dictionary.value(Category, item.category_id, 'category', '') if item.category_id else '',
+            'material': dictionary.value(SecondMaterial, item.second_material_id, 'second_material', ''),
+            'style': dictionary.value(Style, item.style_id, 'style', '')
+        }
+
+
+def build_index():
+    index = SearchIndex()
+    index.sequence = int(local_redis.get('%s:SEQUENCE' % SEARCH) or 0)
+    names = _Names()
+    for item in db.session.query(Item).filter(Item.is_deleted == False, Item.is_component == False):
+        index.add(item.id, names.fields(item))
+    return index
+
+
+def save_index(index, path):
+    temp_path = '%s.tmp' % path
+    with open(temp_path, 'wb') as f:
+        pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
+
+
+def load_index(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _apply_changes(index, item_ids):
+    items = {item.id: item for item in Item.query.filter(Item.id.in_(item_ids))}
+    names = _Names({item.vendor_id for item in items.values()})
+    for item_id in item_ids:
+        item = items.get(item_id)
+        if item is None or item.is_deleted or item.is_component:
+            index.remove(item_id)
+        else:
+            index.add(item_id, names.fields(item))
+
+
+def sync_index(index):
+    """
+    应用其他进程记录的商品变更, 落后太多时重建
+    """
+    latest = int(local_redis.get('%s:SEQUENCE' % SEARCH) or 0)
+    if latest == index.sequence:
+        return index
+    changes = read_changes(SEARCH, index.sequence, latest)
+    if changes is None:
+        return build_index()
+    _apply_changes(index, list({int(item_id) for item_id in changes}))
+    index.sequence = latest
+    return index
+
+
+def get_index():
+    """
+    首次搜索时从索引文件加载, 没有索引文件时从数据库建立
+    """
+    global _index
+    if _index is None:
+        _index = load_index(current_app.config['SEARCH_INDEX_PATH']) or build_index()
+    _index = sync_index(_index)
+    return _index
+
+
+def search(keyword):
+    return get_index().search(keyword)
+
+
+@signals.item_changed.connect
+def _on_item_changed(sender, item):
+    append_changes(SEARCH, [item.id])
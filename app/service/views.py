@@ -1,14 +1,16 @@
 # -*- coding: utf-8 -*-
 from flask import request, Response, jsonify, redirect, url_for, session, abort, g
 
-from app import db
+from app import db, nearby as nearby_index
 from app.constants import CONFIRM_EMAIL, USER_GUIDE, USER_REGISTER, VENDOR_REGISTER, VENDOR_EMAIL_CONFIRM, \
     USER_EMAIL_CONFIRM, USER_RESET_PASSWORD, USER_SMS_CAPTCHA
 from app.models import User, Vendor, Area
 from app.sms import USER_REGISTER_TEMPLATE, VENDOR_REGISTER_TEMPLATE, RESET_PASSWORD_TEMPLATE, USER_GUIDE_TEMPLATE, \
     USER_SMS_CAPTCHA_TEMPLATE
 from app.permission import user_permission
-from app.utils.redis import redis_get
+from app.utils.redis import redis_get, local_cached
+from app.utils.conditional import conditional
+from app.utils.response import dumps
 from app.utils.wmj_captcha import get_image_captcha
 from . import service as service_blueprint
 from .forms import MobileSMSForm, EmailForm, EmailRegisterForm, EmailResetPasswordForm
@@ -120,13 +122,48 @@ def serve_captcha(token):
 
 @service_blueprint.route('/cities')
 def city_list():
-    cities = Area.query.filter(Area.distributor_amount > 0, Area.level == 2)
-    city_dict = {}
-    for city in cities:
-        if city.pinyin_index not in city_dict:
-            city_dict[city.pinyin_index] = {}
-        city_dict[city.pinyin_index][city.pinyin] = {'city': city.area, 'dist_amount': city.distributor_amount}
-    return jsonify(city_dict)
+    def build():
+        cities = Area.query.filter(Area.distributor_amount > 0, Area.level == 2)
+        city_dict = {}
+        for city in cities:
+            if city.pinyin_index not in city_dict:
+                city_dict[city.pinyin_index] = {}
+            city_dict[city.pinyin_index][city.pinyin] = {'city': city.area, 'dist_amount': city.distributor_amount}
+        return dumps(city_dict)
+    return conditional(Response(local_cached('CITY', 'ALL', build), mimetype='application/json'))
+
+
+@service_blueprint.route('/nearby')
+def nearby():
+    """
+    最近的有库存的经销商, 位置由 lng, lat 或地区 cn_id 指定, item_id 限定有该商品库存
+    """
+    lng = request.args.get('lng', type=float)
+    lat = request.args.get('lat', type=float)
+    cn_id = request.args.get('cn_id', type=int)
+    item_id = request.args.get('item_id', type=int)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    # 与 nan 的比较都不成立, 非有限值也在这里排除
+    if lng is not None and lat is not None and not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        abort(400)
+    index = nearby_index.get_index()
+    if lng is None or lat is None:
+        center = index.center(nearby_index.area_cn_ids(cn_id)) if cn_id is not None else None
+        if center is None:
+            return jsonify({'distributors': []})
+        lng, lat = center
+    distributors = []
+    for distance, store in index.nearest(lng, lat, limit, item_id):
+        distributors.append({
+            'id': store.id,
+            'name': store.name,
+            'address': store.address,
+            'ext_number': store.ext_number,
+            'longitude': store.longitude,
+            'latitude': store.latitude,
+            'distance': round(distance, 2)
+        })
+    return jsonify({'distributors': distributors})
 
 
 @service_blueprint.route('/client_ip')
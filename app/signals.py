@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from flask.signals import Namespace
+
+_signals = Namespace()
+
+# 商品新增, 修改, 删除后发送, item=商品
+item_changed = _signals.signal('item-changed')
+# 厂家通过审核后发送, vendor=厂家
+vendor_changed = _signals.signal('vendor-changed')
+# 经销商修改库存后发送, item_id=商品 id, distributor_id=经销商 id
+stock_changed = _signals.signal('stock-changed')
+# 经销商修改地址或被撤销后发送, distributor=经销商
+distributor_changed = _signals.signal('distributor-changed')
@@ -1,11 +1,9 @@
 # -*- coding: utf-8 -*-
-from urllib.parse import urlencode
+from flask import session
 
-from flask import current_app, session
-
-from app import db
+from app import db, sms_dispatch
 from app.models import GuideSMS, User
-from app.tasks import send_sms
+from app.tasks import dispatch_sms
 
 
 USER_REGISTER_TEMPLATE = 'USER_REGISTER_TEMPLATE'
@@ -44,6 +42,5 @@ def sms_generator(template, mobile, **kwargs):
         db.session.commit()
     else:
         return
-    query = urlencode({'mobile': mobile, 'account': current_app.config['SMS_ACCOUNT'],
-                       'pswd': current_app.config['SMS_PASSWORD'], 'msg': message})
-    send_sms.delay('%s?%s' % (current_app.config['SMS_URL'], query))
+    if sms_dispatch.enqueue(mobile, message):
+        dispatch_sms.delay()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+from app import db, local_redis
+from app.models import SMSDelivery
+from app.utils.redis import queue_pop, queue_done, queue_recover
+
+SMS = 'SMS'
+QUEUE = '%s:QUEUE' % SMS
+# FakeGateway 压测时返回的状态码, 压测结束后按该状态码删除发送记录, 不重试
+BENCHMARK_STATUS = -2
+
+
+class HttpGateway(object):
+    """
+    短信网关, 同一内容的短信可以用逗号分隔的多个手机号一次发送
+    """
+    def __init__(self, config):
+        self.url = config['SMS_URL']
+        self.account = config['SMS_ACCOUNT']
+        self.password = config['SMS_PASSWORD']
+        self.timeout = config['SMS_TIMEOUT']
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+    def send(self, mobiles, message):
+        """
+        返回网关的状态码, 0 表示成功
+        """
+        response = self.session.get(self.url, params={'mobile': ','.join(mobiles), 'account': self.account,
+                                                      'pswd': self.password, 'msg': message}, timeout=self.timeout)
+        # 第一行是 "时间,状态码"
+        try:
+            return int(response.content.decode('utf8').split('\n', 1)[0].split(',')[1])
+        except (IndexError, ValueError):
+            return -1
+
+
+class FakeGateway(object):
+    """
+    测试和压测用, 不访问网络, 每次发送等待 latency 秒, 返回 status
+    """
+    def __init__(self, config):
+        self.latency = config.get('SMS_FAKE_LATENCY', 0)
+        self.status = config.get('SMS_FAKE_STATUS', 0)
+        self.sent = []
+
+    def send(self, mobiles, message):
+        if self.latency:
+            time.sleep(self.latency)
+        self.sent.append((list(mobiles), message))
+        return self.status
+
+
+gateways = {'http': HttpGateway, 'fake': FakeGateway}
+_gateway = None
+
+
+def get_gateway():
+    """
+    每个进程一个, 复用连接
+    """
+    global _gateway
+    if _gateway is None:
+        _gateway = gateways[current_app.config['SMS_GATEWAY']](current_app.config)
+    return _gateway
+
+
+def enqueue(mobile, message, queue=QUEUE):
+    """
+    放入发送队列, 返回是否需要安排一次发送任务
+    """
+    local_redis.rpush(queue, json.dumps({'mobile': mobile, 'message': message, 'queued': time.time()}))
+    return bool(local_redis.set('%s:SCHEDULED' % queue, 1, ex=current_app.config['SMS_SCHEDULE_TIMEOUT'], nx=True))
+
+
+def batches(entries, size):
+    """
+    相同内容的短信合并, 每批最多 size 个手机号, 返回 [(消息, [短信])]
+    """
+    groups = {}
+    for entry in entries:
+        groups.setdefault(entry['message'], []).append(entry)
+    for message, group in groups.items():
+        for start in range(0, len(group), size):
+            yield message, group[start:start + size]
+
+
+def _retries(group, status):
+    retries = []
+    for entry in group:
+        if entry.get('retries', 0) < current_app.config['SMS_MAX_RETRIES']:
+            retries.append(json.dumps(dict(entry, retries=entry.get('retries', 0) + 1)))
+        else:
+            current_app.logger.warning('sms to %s dropped after %d retries, status %d' %
+                                       (entry['mobile'], entry.get('retries', 0), status))
+    return retries
+
+
+def dispatch(queue=QUEUE, gateway=None, mobiles_per_request=None):
+    """
+    发送队列中的全部短信, 返回发送的数量.
+    开始时先清除标记, 之后入队的短信会安排新的任务, 不会滞留在队列中.
+    每批短信的发送记录提交后才从处理列表中删除, 失败的短信最多重试 SMS_MAX_RETRIES 次
+    """
+    local_redis.delete('%s:SCHEDULED' % queue)
+    queue_recover(queue)
+    gateway = gateway or get_gateway()
+    mobiles_per_request = mobiles_per_request or current_app.config['SMS_MOBILES_PER_REQUEST']
+    sent = 0
+    while True:
+        batch, entries = queue_pop(queue, current_app.config['SMS_QUEUE_BATCH'],
+                                   current_app.config['SMS_PROCESSING_TIMEOUT'])
+        if not entries:
+            return sent
+        entries = [json.loads(entry) for entry in entries]
+        deliveries = []
+        retries = []
+        for message, group in batches(entries, mobiles_per_request):
+            started = time.time()
+            try:
+                status = gateway.send([entry['mobile'] for entry in group], message)
+            except requests.RequestException as e:
+                current_app.logger.warning('sms gateway error: %s' % e)
+                status = -1
+            finished = time.time()
+            for entry in group:
+                deliveries.append({
+                    'mobile': entry['mobile'],
+                    'status': status,
+                    'batch_size': len(group),
+                    'queued': int(entry['queued']),
+                    'sent': int(finished),
+                    'latency': int((finished - entry['queued']) * 1000),
+                    'gateway_latency': int((finished - started) * 1000)
+                })
+            if status not in (0, BENCHMARK_STATUS):
+                retries.extend(_retries(group, status))
+        db.session.bulk_insert_mappings(SMSDelivery, deliveries)
+        db.session.commit()
+        queue_done(queue, batch, retries)
+        sent += len(deliveries)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import mmap
+import os
+import pickle
+import time
+
+from flask import current_app
+
+from app import statisitc, dictionary, areas
+
+# 快照文件: 一行头部 "WMJSNAPSHOT <格式版本> <结构哈希>", 之后是 pickle 数据.
+# 表结构或统计的结构变化后哈希不同, 旧快照被忽略, 进程回到从 redis 或数据库读取.
+MAGIC = b'WMJSNAPSHOT'
+FORMAT_VERSION = 1
+
+
+def schema_hash():
+    from app.models import Area
+    parts = ['%d' % FORMAT_VERSION, ','.join(sorted(statisitc.statistic_state().keys()))]
+    for model in [Area] + sorted(dictionary._models.values(), key=lambda model: model.__tablename__):
+        parts.append('%s:%s' % (model.__tablename__, ','.join(column.name for column in model.__table__.columns)))
+    return hashlib.md5('|'.join(parts).encode('utf8')).hexdigest()
+
+
+def _header():
+    return b'%s %d %s\n' % (MAGIC, FORMAT_VERSION, schema_hash().encode('ascii'))
+
+
+def save_snapshot(path):
+    """
+    写入统计, 地区和字典表, 先写临时文件再替换, 正在读取的进程不受影响
+    """
+    statisitc.load_statistic()
+    data = {
+        'created': time.time(),
+        'statistic': statisitc.statistic_state(),
+        'areas': [tuple(row) for row in areas.get_index().rows()],
+        'dictionary': dictionary.dump_tables(),
+        'dictionary_version': dictionary.version
+    }
+    temp_path = '%s.%d' % (path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(_header())
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
+    return data
+
+
+def read_snapshot(path):
+    """
+    返回快照内容, 文件不存在, 结构不一致或已损坏时返回 None, 进程回到从 redis 或数据库读取
+    """
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    with f:
+        if f.readline() != _header():
+            current_app.logger.warning('snapshot %s is outdated, ignored' % path)
+            return None
+        offset = f.tell()
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError) as e:
+            current_app.logger.warning('snapshot %s can not be read, ignored: %s' % (path, e))
+            return None
+        view = memoryview(data)[offset:]
+        try:
+            return pickle.loads(view)
+        except (pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError, IndexError) as e:
+            current_app.logger.warning('snapshot %s is corrupt, ignored: %r' % (path, e))
+            return None
+        finally:
+            view.release()
+            data.close()
+
+
+def load_snapshot(path):
+    """
+    进程启动时调用, 之后统计和字典表按 redis 中的代数与版本追上最新状态
+    """
+    data = read_snapshot(path)
+    if data is None:
+        return False
+    statisitc.restore_statistic(data['statistic'])
+    areas.restore_index(data['areas'])
+    dictionary.restore_tables(data['dictionary'], data['dictionary_version'])
+    return True
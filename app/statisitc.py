@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
-from app import db
+import json
+import pickle
+import time
+from collections import deque
+
+from flask import current_app
+from redis.exceptions import LockError
+
+from app import db, local_redis, signals
 from app.models import Category, Item, Vendor, SecondMaterial, \
-    Style, Scene, Distributor, Stock, DistributorAddress, Area
+    Style, Scene
 
 materials = None
 categories = None
@@ -9,8 +17,31 @@ styles = None
 brands = None
 scenes = None
 item_query = None
-items = None
-distributors = None
+# 每个筛选项下的商品数量 {'brand': {vendor_id: amount}, ...}
+counters = None
+# 已统计商品的筛选属性 {item_id: {'brand': vendor_id, ...}}
+item_facets = None
+# 上次全量统计的时间
+rebuild_time = 0
+# 统计的代数, 落后于 redis 中的代数时应用其间的变化记录
+generation = 0
+# 发布这一代统计的时间, 用作筛选结果的 Last-Modified
+modified_time = 0
+# 本进程最近应用的变化 [(代数, 商品 id)], 供筛选索引增量更新
+recent_changes = deque(maxlen=1000)
+
+STATISTIC = 'STATISTIC'
+CHANGES_KEPT = 10000
+
+# 代数加一并写入变化记录, 两步在 redis 中原子执行, 不会出现有代数没有记录的情况
+_publish_script = local_redis.register_script("""
+local generation = redis.call('incr', KEYS[1])
+redis.call('zadd', KEYS[2], generation, generation .. ':' .. ARGV[1])
+redis.call('zremrangebyscore', KEYS[2], 0, generation - tonumber(ARGV[2]))
+return generation
+""")
+
+FACETS = ('brand', 'material', 'category', 'style', 'scene')
 
 
 def materials_statistic():
@@ -68,7 +99,8 @@ def brands_statistic():
     global brands
     brands = {'available': {}, 'available_set': set()}
     query = Vendor.query.filter(Vendor.confirmed == True)
-    vendor_ids = db.session.query(Item.vendor_id).group_by(Item.vendor_id)
+    vendor_ids = db.session.query(Item.vendor_id).filter(Item.is_deleted == False, Item.is_component == False).\
+        group_by(Item.vendor_id)
     query = query.filter(Vendor.id.in_(vendor_ids))
     for vendor in query:
         brands['available'][vendor.id] = {'brand': vendor.brand}
@@ -85,131 +117,397 @@ def scenes_statistic():
     scenes['available_set'] = set(scenes['available'].keys())
 
 
-class DistributorAreaTree(object):
-    def __init__(self):
-        self.children = []
-
-    @staticmethod
-    def add_node(root, *nodes):
-        for node in nodes:
-            for child in root.children:
-                if child.id == node.id:
-                    if node.children:
-                        root.add_node(child, *node.children)
-                        break
-                    elif root.father is not None:
-                        child.distributors = child.distributors + node.distributors
-                        break
-            else:
-                root.children.append(node)
-                node.father = root
-
-    def dumps(self):
-        data = {}
-        for child in self.children:
-            dumps = child.dumps()
-            for k in dumps:
-                data[k] = dumps[k]
-        return data
-
-
-class DistributorAreaNode(DistributorAreaTree):
-    def __init__(self, id, area, father):
-        self.id = id
-        self.area = area
-        self.father = father
-        self.distributors = None
-        super(DistributorAreaNode, self).__init__()
-
-    @staticmethod
-    def _dict_key(node_dict):
-        return list(node_dict.keys())[0]
-
-    @staticmethod
-    def build_from_dict(node_dict):
-        key = DistributorAreaNode._dict_key(node_dict)
-        node = DistributorAreaNode(key, node_dict[key]['area'], None)
-        node.add_child_from_dict(node_dict[key]['children'])
-        return node
-
-    def add_child_from_dict(self, node_dict):
-        key = self._dict_key(node_dict)
-        node = DistributorAreaNode(key, node_dict[key]['area'], father=self)
-        self.children.append(node)
-        if 'children' in node_dict[key]:
-            return node.add_child_from_dict(node_dict[key]['children'])
-        node.distributors = node_dict[key]['distributors']
-
-    def dumps(self):
-        if self.children:
-            data = {self.id: {'area': self.area, 'children': {}}}
-            for child in self.children:
-                dumps = child.dumps()
-                for k in dumps:
-                    data[self.id]['children'][k] = dumps[k]
-            return data
-
-        distributor_dict = {}
-        self.distributors = sorted(list(set(self.distributors)))
-        if len(self.distributors) == 1:
-            distributor = distributors[self.distributors[0]]
-            distributor_dict = {distributor.id: {'name': '%s体验馆' % self.area, 'ext_number': distributor.ext_number}}
-        else:
-            for index, key in zip(range(1, len(self.distributors) + 1), self.distributors):
-                distributor = distributors[key]
-                distributor_dict[key] = {'name': '%s体验馆%d' % (self.area, index), 'ext_number': distributor.ext_number}
-        return {self.id: {'area': self.area, 'distributors': distributor_dict}}
+def _item_facets(item):
+    return {
+        'brand': item.vendor_id,
+        'material': item.second_material_id,
+        'category': item.category_id if not item.is_suite else None,
+        'style': item.style_id,
+        'scene': item.scene_id,
+        'price': item.price,
+        'item': item.item
+    }
 
 
-def distributors_statistic(item_id=None):
-    global items, distributors
-    items = {}
-    if item_id is not None:
-        query = [Item.query.get(item_id)]
-        stock_query = Stock.query.filter(Stock.stock > 0, Stock.item_id == item_id)
-        distributors = query[0].in_stock_distributors()
-    else:
-        query = item_query
-        stock_query = Stock.query.filter(Stock.stock > 0)
-        distributors = {distributor.id: distributor for distributor in Distributor.query.all()}
-    area_list = Area.query.all()
-    cn_areas = {area.cn_id: area for area in area_list}
-    areas = {area.id: area for area in area_list}
-    for address in DistributorAddress.query.all():
-        if address.distributor_id in distributors:
-            distributor = distributors[address.distributor_id]
-            distributor._address = address
-            area = distributor.address._area = cn_areas[distributor.address.cn_id]
-            while area.level > 1:
-                area._father = areas[area.father_id]
-                area = area.father
-    stocks = {}
-    for stock in stock_query.all():
-        try:
-            stocks[stock.item_id].add(stock.distributor_id)
-        except KeyError:
-            stocks[stock.item_id] = {stock.distributor_id}
+def counters_statistic():
+    global counters, item_facets
+    counters = {facet: {} for facet in FACETS}
+    item_facets = {}
+    query = db.session.query(Item.id, Item.vendor_id, Item.second_material_id, Item.category_id, Item.style_id,
+                             Item.scene_id, Item.is_suite, Item.price, Item.item).\
+        filter(Item.vendor_id.in_(brands['available_set']), Item.is_deleted == False, Item.is_component == False)
     for item in query:
-        if item.id in stocks:
-            root = DistributorAreaTree()
-            for distributor_id in stocks[item.id]:
-                distributor = distributors[distributor_id]
-                area = distributor.address.area
-                root.add_node(root, DistributorAreaNode.build_from_dict(area.experience_dict(distributor.id)))
-            items[item.id] = root.dumps()
-    distributors = None
+        facets = item_facets[item.id] = _item_facets(item)
+        for facet in FACETS:
+            if facets[facet] is not None:
+                counters[facet][facets[facet]] = counters[facet].get(facets[facet], 0) + 1
+
+
+def _category_children(category):
+    if category.level == 3:
+        return categories['available'][category.father.father_id]['children'][category.father_id]['children']
+    return categories['available'][category.father_id]['children']
+
+
+def _facet_add(facet, value_id):
+    if facet == 'category':
+        category = Category.query.get(value_id)
+        if category is not None and category.level > 1:
+            node = {'category': category.category}
+            if category.level == 2:
+                node['children'] = {}
+            _category_children(category).setdefault(category.id, node)
+        return
+    # 材料的名称在统计中的键为 material, 与 materials_statistic 一致
+    statistic, model, key, attr = {
+        'brand': (brands, Vendor, 'brand', 'brand'),
+        'material': (materials, SecondMaterial, 'material', 'second_material'),
+        'style': (styles, Style, 'style', 'style'),
+        'scene': (scenes, Scene, 'scene', 'scene')
+    }[facet]
+    instance = model.query.get(value_id)
+    if instance is not None:
+        statistic['available'][value_id] = {key: getattr(instance, attr)}
+        statistic['available_set'].add(value_id)
+
+
+def _facet_remove(facet, value_id):
+    if facet == 'category':
+        category = Category.query.get(value_id)
+        # 非末级分类始终保留, 与 categories_statistic 一致
+        if category is not None and category.level > 1 and \
+                Category.query.filter_by(father_id=category.id).first() is None:
+            _category_children(category).pop(category.id, None)
+        return
+    statistic = {'brand': brands, 'material': materials, 'style': styles, 'scene': scenes}[facet]
+    statistic['available'].pop(value_id, None)
+    statistic['available_set'].discard(value_id)
+
+
+def _counted(item):
+    return not item.is_deleted and not item.is_component and item.vendor is not None and item.vendor.confirmed
+
+
+def _set_facets(item_id, new_facets):
+    old_facets = item_facets.pop(item_id, None)
+    if new_facets is not None:
+        item_facets[item_id] = new_facets
+    for facet in FACETS:
+        old_value = old_facets[facet] if old_facets is not None else None
+        new_value = new_facets[facet] if new_facets is not None else None
+        if old_value == new_value:
+            continue
+        if old_value is not None:
+            counters[facet][old_value] = counters[facet].get(old_value, 1) - 1
+            if counters[facet][old_value] <= 0:
+                del counters[facet][old_value]
+                _facet_remove(facet, old_value)
+        if new_value is not None:
+            counters[facet][new_value] = counters[facet].get(new_value, 0) + 1
+            if counters[facet][new_value] == 1:
+                _facet_add(facet, new_value)
+
+
+def _apply(change_generation, change):
+    """
+    应用一条变化记录, 重复应用同一条记录不改变结果
+    """
+    global generation, modified_time
+    items = change.get('items', {})
+    for item_id in items:
+        _set_facets(int(item_id), items[item_id])
+    generation = change_generation
+    modified_time = change['time']
+    recent_changes.append((change_generation, {int(item_id) for item_id in items}))
+
+
+def publish_change(change):
+    """
+    写入变化记录, 不需要持锁. 本进程的统计是上一代时直接应用
+    """
+    change['time'] = time.time()
+    change_generation = _publish_script(keys=['%s:GENERATION' % STATISTIC, '%s:CHANGES' % STATISTIC],
+                                        args=[json.dumps(change), CHANGES_KEPT])
+    if item_facets is not None and generation == change_generation - 1:
+        _apply(change_generation, change)
+    return change_generation
+
+
+def item_changed(item):
+    """
+    商品新增, 修改, 删除后调用, 只记录该商品新的筛选属性, 各进程只更新该商品涉及的筛选项
+    """
+    publish_change({'items': {item.id: _item_facets(item) if _counted(item) else None}})
+
+
+def vendor_changed(vendor):
+    """
+    厂家通过审核后其商品才会出现在筛选中
+    """
+    items = {}
+    for item in Item.query.filter_by(vendor_id=vendor.id, is_deleted=False, is_component=False):
+        item._vendor = vendor
+        items[item.id] = _item_facets(item) if _counted(item) else None
+    if items:
+        publish_change({'items': items})
+
+
+def _item_query():
+    return db.session.query(Item).\
+        filter(Item.vendor_id.in_(brands['available_set']), Item.is_deleted == False, Item.is_component == False)
 
 
 def init_statistic():
+    global item_query, rebuild_time
     brands_statistic()
-    global item_query
-    item_query = db.session.query(Item).\
-        filter(Item.vendor_id.in_(brands['available_set']), Item.is_deleted == False, Item.is_component == False)
+    item_query = _item_query()
     materials_statistic()
     categories_statistic()
     style_statistic()
     scenes_statistic()
-    distributors_statistic()
+    counters_statistic()
+    rebuild_time = time.time()
+    recent_changes.clear()
+
+
+def rebuild_statistic():
+    """
+    全量统计. 代数取统计开始前的最新代数, 统计期间的变化之后会再应用一次
+    """
+    global generation, modified_time
+    latest = int(local_redis.get('%s:GENERATION' % STATISTIC) or 0)
+    init_statistic()
+    generation = latest
+    modified_time = time.time()
+
+
+def statistic_state():
+    return {
+        'generation': generation,
+        'modified_time': modified_time,
+        'rebuild_time': rebuild_time,
+        'brands': brands,
+        'materials': materials,
+        'categories': categories,
+        'styles': styles,
+        'scenes': scenes,
+        'counters': counters,
+        'item_facets': item_facets
+    }
+
+
+def restore_statistic(snapshot):
+    global generation, modified_time, rebuild_time, brands, materials, categories, styles, scenes, counters, \
+        item_facets, item_query
+    generation = snapshot['generation']
+    modified_time = snapshot['modified_time']
+    rebuild_time = snapshot['rebuild_time']
+    brands = snapshot['brands']
+    materials = snapshot['materials']
+    categories = snapshot['categories']
+    styles = snapshot['styles']
+    scenes = snapshot['scenes']
+    counters = snapshot['counters']
+    item_facets = snapshot['item_facets']
+    item_query = _item_query()
+    recent_changes.clear()
+
+
+def dumps_statistic():
+    return pickle.dumps(statistic_state(), pickle.HIGHEST_PROTOCOL)
+
+
+def loads_statistic(data):
+    restore_statistic(pickle.loads(data))
+
+
+def publish_statistic(reload=False):
+    """
+    全量统计后写入快照, 供新进程读取. reload 时通知所有进程重新读取快照
+    """
+    local_redis.set('%s:SNAPSHOT' % STATISTIC, dumps_statistic())
+    if reload:
+        publish_change({'reload': True})
+
+
+def _changes(after, latest):
+    """
+    返回 [(代数, 变化)], 变化记录已被清理时返回 None
+    """
+    if latest <= after:
+        return [] if latest == after else None
+    members = local_redis.zrangebyscore('%s:CHANGES' % STATISTIC, after + 1, latest, withscores=True)
+    if len(members) != latest - after or int(members[0][1]) != after + 1:
+        return None
+    return [(int(score), json.loads(member.decode().partition(':')[2])) for member, score in members]
+
+
+def _reload():
+    """
+    读取快照并应用之后的变化, 没有快照时返回 False
+    """
+    data = local_redis.get('%s:SNAPSHOT' % STATISTIC)
+    if data is None:
+        return False
+    loads_statistic(data)
+    changes = _changes(generation, int(local_redis.get('%s:GENERATION' % STATISTIC) or 0))
+    if changes is None:
+        current_app.logger.warning('statistic changes after generation %d expired, rebuilt' % generation)
+        rebuild_statistic()
+        return True
+    for change_generation, change in changes:
+        _apply(change_generation, change)
+    return True
+
+
+def _release(lock):
+    """
+    全量统计超过锁的超时时间后锁可能已过期, 释放失败不影响统计的结果
+    """
+    try:
+        lock.release()
+    except LockError:
+        current_app.logger.warning('statistic lock expired before release')
+
+
+def load_statistic():
+    """
+    进程第一次处理请求时调用, 优先读取已发布的统计, 没有时只由一个进程全量统计, 其他进程等待后读取
+    """
+    if item_facets is not None:
+        return
+    started = time.time()
+    if not _reload():
+        lock = local_redis.lock('%s:LOCK' % STATISTIC, timeout=600,
+                                blocking_timeout=current_app.config['STATISTIC_LOAD_TIMEOUT'])
+        locked = lock.acquire()
+        try:
+            if not _reload():
+                rebuild_statistic()
+                publish_statistic()
+        finally:
+            if locked:
+                _release(lock)
+    elapsed = time.time() - started
+    if elapsed > current_app.config['STATISTIC_LOAD_BUDGET']:
+        current_app.logger.warning('statistic loaded in %.3fs, over budget %.3fs' %
+                                   (elapsed, current_app.config['STATISTIC_LOAD_BUDGET']))
+
+
+def sync_statistic(latest=None):
+    """
+    每个请求只比较一次代数, 落后时只应用其间的变化记录, 记录不完整或需要重新读取时才读取快照
+    """
+    if item_facets is None:
+        return
+    if latest is None:
+        latest = int(local_redis.get('%s:GENERATION' % STATISTIC) or 0)
+    if latest == generation:
+        return
+    changes = _changes(generation, latest)
+    if changes is None:
+        _reload()
+        return
+    for change_generation, change in changes:
+        if 'reload' in change:
+            _reload()
+            return
+        _apply(change_generation, change)
+
+
+def changed_items(after):
+    """
+    代数 after 之后变化的商品 id, 本进程没有完整记录时返回 None
+    """
+    if after == generation:
+        return set()
+    if not recent_changes or recent_changes[0][0] > after + 1:
+        return None
+    item_ids = set()
+    for change_generation, changed_ids in recent_changes:
+        if change_generation > after:
+            item_ids.update(changed_ids)
+    return item_ids
+
+
+def _available_snapshot():
+    return {
+        'brand': set(brands['available_set']),
+        'material': set(materials['available_set']),
+        'style': set(styles['available_set']),
+        'scene': set(scenes['available_set']),
+        'category': json.dumps(categories['available'], sort_keys=True),
+        'counters': counters
+    }
+
+
+def check_statistic():
+    """
+    全量统计一次, 校验增量维护的结果并写入新的快照. 由定时任务调用, 不在用户请求中执行
+    """
+    lock = local_redis.lock('%s:LOCK' % STATISTIC, timeout=600)
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        if item_facets is None:
+            _reload()
+        else:
+            sync_statistic()
+        incremental = _available_snapshot() if item_facets is not None else None
+        rebuild_statistic()
+        rebuilt = _available_snapshot()
+        inconsistent = [key for key in rebuilt if incremental is not None and incremental[key] != rebuilt[key]]
+        for key in inconsistent:
+            current_app.logger.warning('statistic %s is inconsistent with database, rebuilt' % key)
+        publish_statistic(reload=bool(inconsistent))
+        return inconsistent
+    finally:
+        _release(lock)
+
+
+@signals.item_changed.connect
+def _on_item_changed(sender, item):
+    item_changed(item)
+
+
+@signals.vendor_changed.connect
+def _on_vendor_changed(sender, vendor):
+    vendor_changed(vendor)
+
+
+def category_path(category_id):
+    """
+    返回可用分类从一级到该分类的 id 列表, 不可用时返回 None
+    """
+    first_categories = categories['available']
+    if category_id in first_categories:
+        return [category_id]
+    for first_id in first_categories:
+        second_categories = first_categories[first_id]['children']
+        if category_id in second_categories:
+            return [first_id, category_id]
+        for second_id in second_categories:
+            if category_id in second_categories[second_id]['children']:
+                return [first_id, second_id, category_id]
+    return None
+
+
+def category_leaves(path):
+    """
+    分类下所有末级分类的 id
+    """
+    if len(path) == 3:
+        return [path[2]]
+    children = categories['available'][path[0]]['children']
+    if len(path) == 2:
+        return list(children[path[1]]['children'].keys()) or [path[1]]
+    category_ids = []
+    for child in children:
+        if not children[child]['children']:
+            category_ids.append(child)
+        else:
+            category_ids.extend(children[child]['children'].keys())
+    return category_ids
 
 
 def selected(statistic, id_list):
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+from heapq import nsmallest
+
+from app import statisitc
+from app.search import pinyin
+
+TOP = 10
+TYPE_ORDER = {'brand': 0, 'category': 1, 'material': 2, 'item': 3}
+VALUE_FACETS = (('brand', 'brand'), ('material', 'material'))
+
+_trie = None
+# 建立前缀树时的 statisitc.item_facets, 统计重新读取后需要重建
+_source = None
+# {item_id: (品牌, 材料, 分类, 商品名)}, 增量更新时用来找出变化前的词
+_items = {}
+
+
+def _keys(text):
+    """
+    汉字, 全拼, 首字母三种前缀都能匹配
+    """
+    keys = {''.join(text.lower().split())}
+    result = pinyin(text)
+    if result is not None:
+        keys.update(result)
+    keys.discard('')
+    return keys
+
+
+def _category_terms(categories, counter, terms):
+    """
+    返回该层分类下的商品数量, 上级分类的数量是下级之和
+    """
+    total = 0
+    for category_id, category in categories.items():
+        amount = counter.get(category_id, 0)
+        if category['children']:
+            amount += _category_terms(category['children'], counter, terms)
+        if amount:
+            terms[('category', category_id, category['category'])] = amount
+        total += amount
+    return total
+
+
+def _value_term(facet, attr, value_id):
+    """
+    品牌或材料的 (词, 权重), 不可用或没有商品时返回 None
+    """
+    value = getattr(statisitc, facet + 's')['available'].get(value_id)
+    amount = statisitc.counters[facet].get(value_id)
+    return ((facet, value_id, value[attr]), amount) if value is not None and amount else None
+
+
+def _item_record(facets):
+    return facets['brand'], facets['material'], facets['category'], facets['item']
+
+
+def statistic_terms():
+    """
+    {(类型, id, 文字): 权重}, 权重为对应的商品数量, 同名商品合并
+    """
+    terms = {}
+    for facet, attr in VALUE_FACETS:
+        for value_id in getattr(statisitc, facet + 's')['available']:
+            term = _value_term(facet, attr, value_id)
+            if term is not None:
+                terms[term[0]] = term[1]
+    _category_terms(statisitc.categories['available'], statisitc.counters['category'], terms)
+    for facets in statisitc.item_facets.values():
+        term = ('item', None, facets['item'])
+        terms[term] = terms.get(term, 0) + 1
+    return terms
+
+
+def term_changes(trie, item_ids):
+    """
+    变化的商品涉及的词的新权重 {词: 权重}, 权重为 None 时删除.
+    只重新计算这些商品变化前后的品牌, 材料和商品名; 分类树很小, 有商品的分类变化时整体比较
+    """
+    changes = {}
+    names = {}
+    values = set()
+    category_changed = False
+    for item_id in item_ids:
+        old = _items.pop(item_id, None)
+        facets = statisitc.item_facets.get(item_id)
+        new = _item_record(facets) if facets is not None else None
+        if new is not None:
+            _items[item_id] = new
+        if old == new:
+            continue
+        for record, delta in ((old, -1), (new, 1)):
+            if record is None:
+                continue
+            values.update((('brand', record[0]), ('material', record[1])))
+            category_changed = category_changed or record[2] is not None
+            names[record[3]] = names.get(record[3], 0) + delta
+    for name, delta in names.items():
+        if delta:
+            term = ('item', None, name)
+            weight = trie.weights.get(term, 0) + delta
+            changes[term] = weight if weight > 0 else None
+    attrs = dict(VALUE_FACETS)
+    for facet, value_id in values:
+        for term in trie.value_terms(facet, value_id):
+            changes[term] = None
+        term = _value_term(facet, attrs[facet], value_id)
+        if term is not None:
+            changes[term[0]] = term[1]
+    if category_changed:
+        terms = {}
+        _category_terms(statisitc.categories['available'], statisitc.counters['category'], terms)
+        for key, term in trie.ids.items():
+            if key[0] == 'category' and term not in terms:
+                changes[term] = None
+        changes.update(terms)
+    return changes
+
+
+class _Node(object):
+    __slots__ = ('children', 'terms', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.terms = frozenset()
+        self.top = ()
+
+
+class SuggestTrie(object):
+    """
+    前缀树, 每个节点保存以该前缀开头的权重最高的 TOP 个词, 查询只需沿前缀走到节点
+    """
+
+    def __init__(self, terms, generation=0):
+        self.root = _Node()
+        self.weights = {}
+        # {(类型, id): 词}, 品牌和分类等按 id 找到当前的词
+        self.ids = {}
+        self.generation = generation
+        self.update(terms)
+
+    def value_terms(self, facet, value_id):
+        term = self.ids.get((facet, value_id))
+        return [term] if term is not None else []
+
+    def _sort_key(self, term):
+        return -self.weights[term], TYPE_ORDER[term[0]], term[2]
+
+    def _refresh(self, node):
+        if not node.children and len(node.terms) == 1:
+            node.top = tuple(node.terms)
+            return
+        candidates = set(node.terms)
+        for child in node.children.values():
+            candidates.update(child.top)
+        if len(candidates) > TOP:
+            node.top = nsmallest(TOP, candidates, key=self._sort_key)
+        else:
+            node.top = sorted(candidates, key=self._sort_key)
+
+    def _path(self, key, create):
+        node = self.root
+        path = []
+        for char in key:
+            if char not in node.children:
+                if not create:
+                    return None
+                node.children[char] = _Node()
+            node = node.children[char]
+            path.append(node)
+        return path
+
+    def build(self, terms):
+        self.weights = dict(terms)
+        self.ids = {term[:2]: term for term in terms if term[1] is not None}
+        for term in terms:
+            for key in _keys(term[2]):
+                node = self._path(key, True)[-1]
+                node.terms = node.terms | {term}
+        stack = [(child, False) for child in self.root.children.values()]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                self._refresh(node)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
+
+    def update(self, terms):
+        """
+        与当前的词和权重比较, 只刷新变化的词经过的节点
+        """
+        if not self.weights:
+            return self.build(terms)
+        changes = {term: None for term in self.weights if term not in terms}
+        changes.update((term, terms[term]) for term in terms if self.weights.get(term) != terms[term])
+        self.apply(changes)
+
+    def apply(self, changes):
+        """
+        changes: {词: 权重}, 权重为 None 时删除该词
+        """
+        dirty = {}
+        for term, weight in changes.items():
+            removed = weight is None
+            if removed:
+                if self.weights.pop(term, None) is None:
+                    continue
+                if term[1] is not None and self.ids.get(term[:2]) == term:
+                    del self.ids[term[:2]]
+            else:
+                self.weights[term] = weight
+                if term[1] is not None:
+                    self.ids[term[:2]] = term
+            for key in _keys(term[2]):
+                path = self._path(key, not removed)
+                if path is None:
+                    continue
+                if removed:
+                    path[-1].terms = path[-1].terms - {term}
+                else:
+                    path[-1].terms = path[-1].terms | {term}
+                for depth, node in enumerate(path):
+                    dirty[id(node)] = (depth, node)
+        for depth, node in sorted(dirty.values(), key=lambda record: -record[0]):
+            self._refresh(node)
+
+    def suggest(self, prefix, limit=TOP):
+        path = self._path(''.join(prefix.lower().split()), False)
+        if not path:
+            return []
+        return [{'type': term[0], 'id': term[1], 'text': term[2], 'amount': self.weights[term]}
+                for term in path[-1].top[:limit]]
+
+
+def get_trie():
+    """
+    统计的代数变化后只更新变化的商品涉及的词, 没有完整的变化记录或统计重新读取后重建
+    """
+    global _trie, _source, _items
+    if statisitc.item_facets is None:
+        statisitc.load_statistic()
+    if _trie is not None and _trie.generation != statisitc.generation and _source is statisitc.item_facets:
+        item_ids = statisitc.changed_items(_trie.generation)
+        if item_ids is not None:
+            _trie.apply(term_changes(_trie, item_ids))
+            _trie.generation = statisitc.generation
+    if _trie is None or _trie.generation != statisitc.generation or _source is not statisitc.item_facets:
+        _source = statisitc.item_facets
+        _items = {item_id: _item_record(facets) for item_id, facets in _source.items()}
+        _trie = SuggestTrie(statistic_terms(), statisitc.generation)
+    return _trie
@@ -5,7 +5,7 @@ from flask.ext.cdn import url_for
 from flask.ext.login import logout_user, current_user
 from flask.ext.principal import identity_changed, AnonymousIdentity
 from app import db
-from app.models import Collection, Item
+from app.models import Collection, Item, prefetch
 from app.constants import *
 from app.permission import user_permission
 from app.utils import items_json
@@ -124,7 +124,7 @@ def collection():
         per_page = 10
         query = Collection.query.filter_by(user_id=current_user.id)
         amount = query.count()
-        collections = query.paginate(page, per_page, False).items
+        collections = prefetch(query.paginate(page, per_page, False).items, 'item')
         collection_dict = {'collections': items_json([collection.item for collection in collections]),
                            'amount': amount, 'page': page, 'pages': ceil(amount / per_page)}
         return jsonify(collection_dict)
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
+import base64
 import hashlib
+import json
 import random
 import time
+import uuid
 
-from flask import current_app, request
+from flask import current_app, request, session, Response
 from flask.ext.cdn import url_for
+from sqlalchemy import and_, or_, func
 
 from ._compat import PY3
 
@@ -30,7 +34,44 @@ def _data_convert(args):
     return data
 
 
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf8')).decode('ascii')
+
+
+def decode_cursor(token, length):
+    """
+    返回游标中的值, 游标无效时返回 None
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf8'))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return values if isinstance(values, list) and len(values) == length else None
+
+
+def seek(query, column, value, id_column, id_, desc=False):
+    """
+    keyset 分页: 按 (column, id) 排序时排在 (value, id_) 之后的记录, 不需要 offset 扫描前面的行
+    """
+    if desc:
+        return query.filter(or_(column < value, and_(column == value, id_column < id_)))
+    return query.filter(or_(column > value, and_(column == value, id_column > id_)))
+
+
 class DataTableHandler(object):
+    """
+    params 中每一列可以用 'prefetch' 声明该列用到的关系, 当前页的记录会一次性批量读取.
+    'prefetch' 也可以是函数, 以当前页的记录为参数, 用于关系以外的批量读取.
+
+    前 OFFSET_PAGES 页用 offset 分页, 之后用上一页最后一条记录的 (排序列, id) 作为游标.
+    游标在返回数据的 'cursor' 中, 同时按会话和查询保存在 redis 中, 顺序翻页的 DataTables 不需要传回游标.
+    总数只统计一次, 超过 LARGE_COUNT 的总数缓存 COUNT_DURATION 秒.
+    """
+    OFFSET_PAGES = 5
+    CURSOR_DURATION = 600
+    LARGE_COUNT = 10000
+    COUNT_DURATION = 60
+
     def __init__(self, params):
         self.params = params
         self.start = None
@@ -45,25 +86,103 @@ class DataTableHandler(object):
         valid_length = [10, 25, 50, 100]
         self.length = length if length in valid_length else valid_length[0]
 
-    def query_params(self, query):
-        self.data['recordsTotal'] = query.count()
-        self.data['recordsFiltered'] = query.count()
+    @staticmethod
+    def _signature(query):
+        statement = query.statement.compile()
+        return md5(('%s%s' % (statement, sorted(statement.params.items()))).encode('utf8'))
+
+    @staticmethod
+    def _client():
+        """
+        每个会话一个随机 id, 其他客户端保存的游标不会影响本会话的分页
+        """
+        client = session.get('datatable_client')
+        if client is None:
+            client = session['datatable_client'] = uuid.uuid4().hex
+        return client
+
+    def _cursor_key(self, signature, order_key, order_dir, start):
+        return 'DATATABLE_CURSOR:%s:%s:%s:%s:%d:%d' % (self._client(), signature, order_key, order_dir, self.length,
+                                                       start)
+
+    def _cursor(self, signature, order_key, order_dir):
+        from app import local_redis
+        token = request.args.get('cursor')
+        if token is None:
+            token = local_redis.get(self._cursor_key(signature, order_key, order_dir, self.start))
+            token = token.decode() if token else None
+        cursor = decode_cursor(token, 5) if token else None
+        if cursor is None or cursor[:3] != [self.start, order_key, order_dir]:
+            return None
+        return cursor[3:]
+
+    def _count(self, query, signature, id_column):
+        from app import local_redis
+        key = 'DATATABLE_COUNT:%s' % signature
+        count = local_redis.get(key)
+        if count is not None:
+            return int(count)
+        count = query.with_entities(func.count(id_column)).order_by(None).scalar()
+        if count >= self.LARGE_COUNT:
+            local_redis.set(key, count, self.COUNT_DURATION)
+        return count
+
+    def records(self, query, id_column=None):
+        """
+        统计总数并读取当前页的记录, id_column: 用于 keyset 分页的唯一列, 默认是查询模型的 id
+        """
+        from app import local_redis
+        from app.models import prefetch
+        if id_column is None:
+            id_column = query.column_descriptions[0]['type'].id
+        signature = self._signature(query)
+        self.data['recordsTotal'] = self.data['recordsFiltered'] = self._count(query, signature, id_column)
         order_column = request.args.get('order[0][column]', '')
         order_key = request.args.get('columns[%s][data]' % order_column, '')
         order_dir = request.args.get('order[0][dir]')
-        if order_key and order_key in self.params and self.params[order_key]['orderable']:
-            if order_dir == 'desc':
-                query = query.order_by(-self.params[order_key]['order_key'])
-            else:
-                query = query.order_by(self.params[order_key]['order_key'])
-        query = query.offset(self.start).limit(self.length)
-        for record in query:
-            data = {}
-            for param in self.params:
-                data[param] = self.params[param]['data'](record)
-            self.data['data'].append(data)
+        if not (order_key and order_key in self.params and self.params[order_key]['orderable']):
+            order_key = None
+        order_dir = 'desc' if order_dir == 'desc' else 'asc'
+        column = self.params[order_key]['order_key'] if order_key else id_column
+        if self.start >= self.OFFSET_PAGES * self.length:
+            cursor = self._cursor(signature, order_key, order_dir)
+        else:
+            cursor = None
+        page_query = query.order_by(column.desc() if order_dir == 'desc' else column,
+                                    id_column.desc() if order_dir == 'desc' else id_column)
+        if cursor is not None:
+            page_query = seek(page_query, column, cursor[0], id_column, cursor[1], order_dir == 'desc')
+        else:
+            page_query = page_query.offset(self.start)
+        records = page_query.limit(self.length).all()
+        if len(records) == self.length:
+            last = records[-1]
+            value = getattr(last, column.key)
+            token = encode_cursor(self.start + self.length, order_key, order_dir, value, getattr(last, id_column.key))
+            self.data['cursor'] = token
+            local_redis.set(self._cursor_key(signature, order_key, order_dir, self.start + self.length), token,
+                            self.CURSOR_DURATION)
+        loaders = [self.params[param]['prefetch'] for param in self.params if 'prefetch' in self.params[param]]
+        prefetch(records, *{loader for loader in loaders if not callable(loader)})
+        for loader in loaders:
+            if callable(loader) and records:
+                loader(records)
+        return records
+
+    def row(self, record):
+        return {param: self.params[param]['data'](record) for param in self.params}
+
+    def query_params(self, query, id_column=None):
+        for record in self.records(query, id_column):
+            self.data['data'].append(self.row(record))
         return self.data
 
+    def response(self, query, id_column=None):
+        """
+        一页最多 100 行, 全部序列化后再返回, 出错时不会输出不完整的 JSON
+        """
+        return Response(json.dumps(self.query_params(query, id_column)), mimetype='application/json')
+
 
 def data_table_params():
     draw = request.args.get('draw', 1, type=int)
@@ -75,15 +194,16 @@ def data_table_params():
 
 
 def items_json(items):
-    from app.models import Item
+    from app.models import Item, prefetch
     if not items:
         return []
     elif isinstance(items[0], Item):
         item_query = items
     else:
-        item_query = Item.query.filter(Item.id.in_(items))
+        item_dict = {item.id: item for item in Item.query.filter(Item.id.in_(items))}
+        item_query = [item_dict[item_id] for item_id in items if item_id in item_dict]
     item_list = []
-    for item in item_query:
+    for item in prefetch(item_query, 'images'):
         image = item.images.first()
         image_url = image.url if image else url_for('static', filename='img/user/item_default_img.jpg')
         item_list.append({
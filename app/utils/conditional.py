@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from flask import current_app, request, Response
+from flask.ext.login import current_user
+
+from app.utils.response import unencoded_environ
+
+
+def _last_modified(timestamp):
+    return datetime.datetime.utcfromtimestamp(int(timestamp)) if timestamp else None
+
+
+def _cache_control(response):
+    """
+    匿名用户的响应可以被浏览器和 CDN 缓存, 登录用户的响应每次都需要验证
+    """
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['HTTP_CACHE_MAX_AGE']
+    return response
+
+
+def not_modified(etag, timestamp=None):
+    """
+    请求带的 ETag 或 Last-Modified 与当前版本一致时返回 304 响应, 否则返回 None, 调用前不需要生成内容
+    """
+    if not request.if_none_match and request.if_modified_since is None:
+        return None
+    response = Response()
+    response.set_etag(etag)
+    response.last_modified = _last_modified(timestamp)
+    response.make_conditional(unencoded_environ(request.environ))
+    return _cache_control(response) if response.status_code == 304 else None
+
+
+def conditional(response, etag=None, timestamp=None):
+    """
+    加上验证器和 Cache-Control, 没有指定 etag 时按内容计算
+    """
+    if etag is None:
+        response.add_etag()
+    else:
+        response.set_etag(etag)
+    response.last_modified = _last_modified(timestamp)
+    _cache_control(response)
+    return response.make_conditional(unencoded_environ(request.environ))
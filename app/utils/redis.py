@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 import json
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
 
-from flask import current_app
+from flask import current_app, request
+from redis.exceptions import RedisError
 
 from app import local_redis
 from app.constants import CONFIRM_EMAIL, REGISTER_ACTION, IMAGE_CAPTCHA
@@ -29,3 +35,284 @@ def redis_get(content_type, key, delete=False, serialize=False):
 
 def redis_verify(content_type, key, value, delete=False):
     return value == redis_get(content_type, key, delete)
+
+
+# redis_cached 的参数: 过期后继续提供旧值的时间, 重建锁的时间, 没有旧值时等待其他进程重建的时间
+CACHE_STALE = 3600
+CACHE_LOCK_TIMEOUT = 30
+CACHE_WAIT = 5
+CACHE_WAIT_INTERVAL = 0.05
+CACHE_BETA = 1.0
+
+
+def _cache_entry(value):
+    """
+    缓存值的第一行是 "过期时间 重建耗时", 返回 (过期时间, 重建耗时, 数据)
+    """
+    header, _, data = value.partition('\n')
+    try:
+        expires, delta = map(float, header.split(' '))
+    except ValueError:
+        return 0, 0, value
+    return expires, delta, data
+
+
+def _cache_rebuild(key, compute, expire):
+    started = time.time()
+    data = compute()
+    now = time.time()
+    local_redis.set(key, '%.3f %.3f\n%s' % (now + expire, now - started, data), expire + CACHE_STALE)
+    return data
+
+
+def redis_cached(content_type, key, compute, expire=None):
+    """
+    compute 返回字符串, 同一时间只有一个进程重建缓存.
+    快过期时按重建耗时提前随机重建, 其他进程在重建期间继续使用旧值, 没有旧值时等待重建结果
+    """
+    key = '%s:%s' % (content_type, key)
+    lock_key = '%s:LOCK' % key
+    expire = expire if expire else current_app.config['%s_DURATION' % content_type]
+    value = local_redis.get(key)
+    if value is not None:
+        expires, delta, data = _cache_entry(value.decode())
+        if time.time() - delta * CACHE_BETA * math.log(1 - random.random()) < expires:
+            return data
+        if local_redis.set(lock_key, 1, ex=CACHE_LOCK_TIMEOUT, nx=True):
+            try:
+                return _cache_rebuild(key, compute, expire)
+            finally:
+                local_redis.delete(lock_key)
+        return data
+    waited = 0
+    while not local_redis.set(lock_key, 1, ex=CACHE_LOCK_TIMEOUT, nx=True):
+        if waited >= CACHE_WAIT:
+            return compute()
+        time.sleep(CACHE_WAIT_INTERVAL)
+        waited += CACHE_WAIT_INTERVAL
+        value = local_redis.get(key)
+        if value is not None:
+            return _cache_entry(value.decode())[2]
+    try:
+        value = local_redis.get(key)
+        if value is not None:
+            return _cache_entry(value.decode())[2]
+        return _cache_rebuild(key, compute, expire)
+    finally:
+        local_redis.delete(lock_key)
+
+
+# 变化记录: <name>:SEQUENCE 是最后一条记录的序号, <name>:CHANGES 的成员为 "序号:内容", 分数为序号.
+# 序号加一和写入记录在同一个脚本中执行, 读取的进程不会看到有序号没有记录的情况
+CHANGES_KEPT = 10000
+
+_append_script = local_redis.register_script("""
+local latest = 0
+for i = 2, #ARGV do
+    latest = redis.call('incr', KEYS[1])
+    redis.call('zadd', KEYS[2], latest, latest .. ':' .. ARGV[i])
+end
+redis.call('zremrangebyscore', KEYS[2], 0, latest - tonumber(ARGV[1]))
+return latest
+""")
+
+
+def append_changes(name, payloads, kept=CHANGES_KEPT):
+    """
+    追加变化记录, 返回最后一条的序号
+    """
+    payloads = list(payloads)
+    if not payloads:
+        return None
+    return _append_script(keys=['%s:SEQUENCE' % name, '%s:CHANGES' % name], args=[kept] + payloads)
+
+
+def read_changes(name, after, latest):
+    """
+    返回序号 after 之后直到 latest 的记录内容, 有记录已被清理时返回 None
+    """
+    if latest <= after:
+        return [] if latest == after else None
+    members = local_redis.zrangebyscore('%s:CHANGES' % name, after + 1, latest)
+    if len(members) != latest - after:
+        return None
+    return [member.decode().partition(':')[2] for member in members]
+
+
+# 发送队列: 取出的一批先移到 <queue>:PROCESSING:<id>, 处理结果写入数据库后才删除.
+# 进程中断时该批在超时后放回队列; 需要重试的条目放入 <queue>:RETRY, 下一次发送任务开始时放回队列
+_queue_pop_script = local_redis.register_script("""
+local entries = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #entries > 0 then
+    redis.call('ltrim', KEYS[1], #entries, -1)
+    redis.call('rpush', KEYS[2], unpack(entries))
+    redis.call('zadd', KEYS[3], ARGV[2], KEYS[2])
+end
+return entries
+""")
+
+_queue_recover_script = local_redis.register_script("""
+local function move(source)
+    local entries = redis.call('lrange', source, 0, -1)
+    for start = 1, #entries, 1000 do
+        redis.call('rpush', KEYS[1], unpack(entries, start, math.min(start + 999, #entries)))
+    end
+    redis.call('del', source)
+    return #entries
+end
+local moved = move(KEYS[3])
+for i, batch in ipairs(redis.call('zrangebyscore', KEYS[2], 0, ARGV[1])) do
+    moved = moved + move(batch)
+    redis.call('zrem', KEYS[2], batch)
+end
+return moved
+""")
+
+
+def queue_pop(queue, size, timeout):
+    """
+    取出最多 size 条, 返回 (批次, [条目]). timeout 秒内没有调用 queue_done 的批次会被放回队列
+    """
+    batch = '%s:PROCESSING:%s' % (queue, uuid.uuid4().hex)
+    entries = _queue_pop_script(keys=[queue, batch, '%s:PROCESSING' % queue], args=[size, time.time() + timeout])
+    return batch, [entry.decode() for entry in entries]
+
+
+def queue_done(queue, batch, retries=()):
+    """
+    该批处理完成, retries 为需要重试的条目
+    """
+    pipeline = local_redis.pipeline()
+    if retries:
+        pipeline.rpush('%s:RETRY' % queue, *retries)
+    pipeline.delete(batch)
+    pipeline.zrem('%s:PROCESSING' % queue, batch)
+    pipeline.execute()
+
+
+def queue_recover(queue):
+    """
+    待重试的条目和超时未完成的批次放回队列, 返回放回的条数. 发送任务开始时调用
+    """
+    local_redis.delete('%s:RETRY_SCHEDULED' % queue)
+    return _queue_recover_script(keys=[queue, '%s:PROCESSING' % queue, '%s:RETRY' % queue], args=[time.time()])
+
+
+def queue_retry_pending(queue, delay):
+    """
+    有待重试的条目且 delay 秒内没有安排过重试时返回 True, 调用方在 delay 秒后安排一次发送任务
+    """
+    return bool(local_redis.llen('%s:RETRY' % queue)) and \
+        bool(local_redis.set('%s:RETRY_SCHEDULED' % queue, 1, ex=delay, nx=True))
+
+
+CACHE_CHANNEL = 'CACHE:INVALIDATE'
+
+
+class LocalCache(object):
+    """
+    进程内的 LRU 缓存, 超过 ttl 秒或超出 size 个时丢弃
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.time() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+_local_cache = None
+_pubsub = None
+
+
+def local_cache():
+    global _local_cache
+    if _local_cache is None:
+        _local_cache = LocalCache(current_app.config['LOCAL_CACHE_SIZE'], current_app.config['LOCAL_CACHE_TTL'])
+    return _local_cache
+
+
+def local_cached(content_type, key, compute, expire=None):
+    """
+    在 redis_cached 前加一层进程内缓存, 命中时不访问 redis
+    """
+    cache = local_cache()
+    full_key = '%s:%s' % (content_type, key)
+    data = cache.get(full_key)
+    if data is None:
+        data = redis_cached(content_type, key, compute, expire)
+        cache.set(full_key, data)
+    return data
+
+
+def cache_invalidate(content_type, key):
+    """
+    删除 redis 中的缓存, 并通知所有进程删除进程内缓存
+    """
+    full_key = '%s:%s' % (content_type, key)
+    local_redis.delete(full_key)
+    local_cache().delete(full_key)
+    local_redis.publish(CACHE_CHANNEL, full_key)
+
+
+def sync_local_cache():
+    """
+    每个请求开始时取出已收到的失效通知, 订阅断开期间的通知会丢失, 因此重新订阅时清空进程内缓存
+    """
+    global _pubsub
+    cache = local_cache()
+    try:
+        if _pubsub is None:
+            _pubsub = local_redis.pubsub(ignore_subscribe_messages=True)
+            _pubsub.subscribe(CACHE_CHANNEL)
+            cache.clear()
+        message = _pubsub.get_message()
+        while message is not None:
+            if message['type'] == 'message':
+                cache.delete(message['data'].decode())
+            message = _pubsub.get_message()
+    except RedisError:
+        _pubsub = None
+        cache.clear()
+
+
+def register_sync(app, key, sync):
+    """
+    sync(latest) 在该应用的每个请求开始时调用, latest 为 key 在 redis 中的整数值
+    """
+    app.extensions.setdefault('version_syncs', OrderedDict())[key] = sync
+
+
+def sync_versions():
+    """
+    before_request: 处理缓存失效通知, 所有版本号用一次 MGET 读取. 静态文件不需要同步
+    """
+    if request.endpoint == 'static':
+        return
+    sync_local_cache()
+    syncs = current_app.extensions.get('version_syncs')
+    if not syncs:
+        return
+    keys = list(syncs)
+    for key, value in zip(keys, local_redis.mget(keys)):
+        syncs[key](int(value or 0))
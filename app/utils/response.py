@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import re
+
+from flask import current_app, request, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'text/html', 'text/css', 'application/javascript', 'text/plain')
+# 压缩后的 ETag 加上编码后缀, 同一个资源的不同编码不能共用强 ETag
+ENCODED_ETAG = re.compile(r'-(?:gzip|br)"')
+
+
+def dumps(obj, sort_keys=False):
+    """
+    紧凑的 JSON, 依次使用 orjson, ujson, json. 非 ASCII 字符不转义, 字典的整数键转换为字符串
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            return orjson.dumps(obj, option=option).decode('utf8')
+        except TypeError:
+            pass
+    elif ujson is not None:
+        try:
+            return ujson.dumps(obj, ensure_ascii=False, sort_keys=sort_keys)
+        except (TypeError, OverflowError):
+            pass
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, separators=(',', ':'))
+
+
+def jsonify(*args, **kwargs):
+    return Response(dumps(dict(*args, **kwargs)), mimetype='application/json')
+
+
+def _encoding():
+    accepted = request.headers.get('Accept-Encoding', '')
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """
+    after_request: 超过 COMPRESS_MIN_SIZE 的文本响应按客户端支持的编码压缩, ETag 加上编码后缀
+    """
+    if response.status_code == 304:
+        return _encoded_not_modified(response)
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed or \
+            'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    if encoding == 'br':
+        data = brotli.compress(data, quality=current_app.config['COMPRESS_LEVEL'])
+    else:
+        data = gzip.compress(data, current_app.config['COMPRESS_LEVEL'])
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag('%s-%s' % (etag, encoding), weak)
+    return response
+
+
+def _encoded_not_modified(response):
+    """
+    304 响应带上客户端缓存的压缩版本的 ETag
+    """
+    etag, weak = response.get_etag()
+    encoding = _encoding()
+    if etag is not None and encoding is not None and request.if_none_match.contains('%s-%s' % (etag, encoding)):
+        response.set_etag('%s-%s' % (etag, encoding), weak)
+    return response
+
+
+def unencoded_environ(environ):
+    """
+    去掉 If-None-Match 中的编码后缀, 用于和未压缩的 ETag 比较
+    """
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and ENCODED_ETAG.search(if_none_match):
+        environ = dict(environ, HTTP_IF_NONE_MATCH=ENCODED_ETAG.sub('"', if_none_match))
+    return environ
@@ -5,7 +5,8 @@ from flask import session
 from wtforms.validators import Regexp, Email as BaseEmail, ValidationError
 from PIL import Image as BaseImage
 
-from app.models import User, Vendor, Area
+from app.areas import find_area
+from app.models import User, Vendor
 from app.constants import IMAGE_CAPTCHA
 from app.utils import IO
 from app.utils.redis import redis_verify
@@ -72,8 +73,8 @@ class AreaValidator(object):
         self.message = message
 
     def __call__(self, form, field):
-        area = Area.query.filter_by(cn_id=field.data).limit(1).first()
-        if not area or Area.query.filter_by(father_id=area.id).count() > 0:
+        area = find_area(field.data)
+        if not area or area.children():
             raise ValidationError(self.message)
 
 
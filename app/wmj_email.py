@@ -1,10 +1,8 @@
 # -*- coding: utf-8 -*-
-from flask import current_app, render_template
-from flask.ext.mail import Message
-
+from app import mailer
 from app.constants import USER_EMAIL_CONFIRM, VENDOR_EMAIL_CONFIRM, USER_EMAIL_RESET_PASSWORD, \
     USER_REGISTER, ADMIN_EMAIL_REMINDS, USER_FEEDBACK
-from app.tasks import send_email as async_email
+from app.tasks import dispatch_email
 
 
 ADMIN_REMINDS_SUBJECT = '新的厂家注册'
@@ -14,18 +12,18 @@ EMAIL_CONFIRM_SUBJECT = u'激活邮箱'
 def send_email(to, subject, email_type, **kwargs):
     if not isinstance(to, (list, tuple)):
         to = [to]
-    msg = Message(subject, sender=current_app.config['WMJ_MAIL_SENDER'], recipients=to)
+    html = body = None
     if email_type == VENDOR_EMAIL_CONFIRM:
-        msg.html = render_template('site/vendor_email_confirm.html', url=kwargs['url'])
+        html = mailer.render_email(email_type, 'site/vendor_email_confirm.html', kwargs['url'])
     elif email_type == USER_EMAIL_CONFIRM:
-        msg.html = render_template('site/user_email_confirm.html', url=kwargs['url'])
+        html = mailer.render_email(email_type, 'site/user_email_confirm.html', kwargs['url'])
     elif email_type == ADMIN_EMAIL_REMINDS:
-        msg.html = '<p>有新的厂家注册了, 快去审核!</p>'
+        html = '<p>有新的厂家注册了, 快去审核!</p>'
     # elif email_type == USER_REGISTER:
-    #     msg.html = render_template('site/user_register.html', url=kwargs['url'])
-        async_email.delay(msg)
+    #     html = mailer.render_email(email_type, 'site/user_register.html', kwargs['url'])
     elif email_type == USER_EMAIL_RESET_PASSWORD:
-        msg.html = render_template('site/user_reset_password.html', url=kwargs['url'])
+        html = mailer.render_email(email_type, 'site/user_reset_password.html', kwargs['url'])
     elif email_type == USER_FEEDBACK:
-        msg.body = '用户反馈内容: %s\n用户联系方式: %s\n用户绑定手机号: %s' % (kwargs['feedback'], kwargs['contact'], kwargs['mobile'])
-    async_email.delay(msg)
+        body = '用户反馈内容: %s\n用户联系方式: %s\n用户绑定手机号: %s' % (kwargs['feedback'], kwargs['contact'], kwargs['mobile'])
+    if mailer.enqueue(list(to), subject, html=html, body=body):
+        dispatch_email.delay()
@@ -19,9 +19,53 @@ class Config(object):
     SMS_CAPTCHA_DURATION = 600
     IMAGE_CAPTCHA_DURATION = 600
     ITEM_PER_PAGE = 40
+    STATISTIC_CHECK_INTERVAL = 3600  # seconds, 全量统计校验间隔
+    STATISTIC_LOAD_TIMEOUT = 60  # seconds, 等待其他进程完成全量统计的时间
+    STATISTIC_LOAD_BUDGET = 0.5  # seconds, 首次读取统计超过该时间时记录警告
+    ITEM_STORES_CACHE_SIZE = 2000  # 每个进程缓存体验馆的商品数
+    ITEM_STORES_DURATION = 86400  # seconds, redis 中商品体验馆的过期时间
+    LOCAL_CACHE_SIZE = 256  # 每个进程缓存的 JSON 数
+    LOCAL_CACHE_TTL = 60  # seconds, 进程内缓存的最长时间, 失效通知丢失时的上限
+    HTTP_CACHE_MAX_AGE = 60  # seconds, 匿名用户的 JSON 在浏览器和 CDN 中的缓存时间
+    JSONIFY_PRETTYPRINT_REGULAR = False
+    COMPRESS_MIN_SIZE = 1024  # bytes, 小于该大小的响应不压缩
+    COMPRESS_LEVEL = 6
+    CITY_DURATION = 86400
+    ITEM_DETAIL_DURATION = 86400  # seconds, 商品详情 JSON 在 redis 中的缓存时间, 修改后会主动失效
     CDN_DOMAIN = 'static.wanmujia.com'
     CDN_TIMESTAMP = False
     CONFIG_PATH = os.path.join(basedir, 'config.json')
+    SEARCH_INDEX_PATH = os.path.join(basedir, 'search_index.pickle')
+    SNAPSHOT_PATH = os.path.join(basedir, 'snapshot.bin')
+
+    GEOCODER_BACKEND = 'baidu'
+    GEOCODER_URL = 'http://api.map.baidu.com/geocoder/v2/'
+    CREATE_POI_URL = 'http://api.map.baidu.com/geodata/v3/poi/create'
+    UPDATE_POI_URL = 'http://api.map.baidu.com/geodata/v3/poi/update'
+    GEOCODER_AK = 'sdp9qCbToS7E23nDRxaAAwbh'
+    GEOTABLE_ID = '121763'
+    GEOCODER_TIMEOUT = 5  # seconds
+    GEOCODER_RETRIES = 3
+    GEOCODER_CONCURRENCY = 16  # 批量解析的并发数, 也是连接池大小
+    GEOCODE_DURATION = 86400 * 30  # seconds, 地址解析结果的缓存时间
+
+    SMS_GATEWAY = 'http'
+    SMS_TIMEOUT = 5  # seconds
+    SMS_QUEUE_BATCH = 500  # 发送任务每次从队列取出的短信数
+    SMS_MOBILES_PER_REQUEST = 100  # 相同内容的短信每个请求的手机号数
+    SMS_SCHEDULE_TIMEOUT = 300  # seconds, 发送任务未执行时重新安排的时间
+    SMS_PROCESSING_TIMEOUT = 600  # seconds, 取出后超过该时间没有完成的短信放回队列
+    SMS_MAX_RETRIES = 3  # 发送失败的短信的重试次数
+    SMS_RETRY_DELAY = 60  # seconds, 发送失败后等待该时间再重试
+
+    MAIL_TIMEOUT = 10  # seconds
+    MAIL_IDLE_TIMEOUT = 60  # seconds, SMTP 连接空闲超过该时间后重新连接
+    MAIL_QUEUE_BATCH = 100  # 发送任务每次从队列取出的邮件数
+    MAIL_DEDUP_DURATION = 600  # seconds, 该时间内相同的邮件只发送一次
+    MAIL_SCHEDULE_TIMEOUT = 300  # seconds, 发送任务未执行时重新安排的时间
+    MAIL_PROCESSING_TIMEOUT = 600  # seconds, 取出后超过该时间没有发送完的邮件放回队列
+    MAIL_MAX_RETRIES = 3  # 发送失败的邮件的重试次数
+    MAIL_RETRY_DELAY = 60  # seconds, 发送失败后等待该时间再重试
 
     ADMIN_EMAILS = []
     WMJ_MAIL_SENDER = (u'万木家', 'notification@wanmujia.com')
@@ -58,6 +102,7 @@ class TestingConfig(Config):
     DEBUG_TB_ENABLED = False
     SERVER_NAME = 'localhost'
     IMAGE_DIR = os.path.join(basedir, 'app/static/')
+    SMS_GATEWAY = 'fake'
 
     @classmethod
     def init_app(cls, app):
@@ -102,6 +147,12 @@ class ProductionConfig(Config):
 
 
 class CeleryConfig(Config):
+    CELERYBEAT_SCHEDULE = {
+        'check-statistic': {
+            'task': 'check_statistic',
+            'schedule': datetime.timedelta(seconds=Config.STATISTIC_CHECK_INTERVAL)
+        }
+    }
 
     @classmethod
     def init_app(cls, app):
@@ -114,6 +165,9 @@ class CeleryConfig(Config):
         cls.MAIL_USE_SSL = config_dict['MAIL_USE_SSL']
         cls.MAIL_USERNAME = config_dict['MAIL_USERNAME']
         cls.MAIL_PASSWORD = config_dict['MAIL_PASSWORD']
+        cls.SMS_ACCOUNT = config_dict['SMS_ACCOUNT']
+        cls.SMS_PASSWORD = config_dict['SMS_PASSWORD']
+        cls.SMS_URL = config_dict['SMS_URL']
 
 
 config = {
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import time
 
 COV = None
 if os.environ.get('FLASK_COVERAGE'):
@@ -45,5 +46,113 @@ def test(coverage=False):
         COV.erase()
 
 
+@manager.command
+def search_index():
+    """Build the item search index file."""
+    from app import search
+    index = search.build_index()
+    search.save_index(index, app.config['SEARCH_INDEX_PATH'])
+    print('%d items indexed' % len(index.names))
+
+
+@manager.command
+def statistic():
+    """Rebuild and publish the item statistic before starting workers."""
+    from app import statisitc
+    started = time.time()
+    statisitc.rebuild_statistic()
+    statisitc.publish_statistic(reload=True)
+    print('statistic generation %d published in %.3fs' % (statisitc.generation, time.time() - started))
+
+
+@manager.command
+def statistic_check():
+    """Rebuild the item statistic and report drift from the incremental one."""
+    from app import statisitc
+    started = time.time()
+    inconsistent = statisitc.check_statistic()
+    if inconsistent is None:
+        print('statistic is being rebuilt by another process')
+    else:
+        print('statistic checked in %.3fs, inconsistent: %s' % (time.time() - started, ', '.join(inconsistent) or 'none'))
+
+
+@manager.command
+def snapshot():
+    """Write the statistic, area and dictionary snapshot loaded by workers at startup."""
+    from app import snapshot as app_snapshot
+    started = time.time()
+    data = app_snapshot.save_snapshot(app.config['SNAPSHOT_PATH'])
+    print('snapshot of %d items written in %.3fs' % (len(data['statistic']['item_facets']), time.time() - started))
+    started = time.time()
+    app_snapshot.read_snapshot(app.config['SNAPSHOT_PATH'])
+    print('snapshot read in %.3fs' % (time.time() - started))
+
+
+@manager.command
+def distributor_amount():
+    """Recount distributors per city and fix the drifted counters."""
+    changed = models.DistributorAddress.reconcile_distributor_amount()
+    for city_id in sorted(changed):
+        print('area %d: %d -> %d' % ((city_id,) + changed[city_id]))
+    print('%d cities reconciled' % len(changed))
+
+
+@manager.option('-c', '--concurrency', dest='concurrency', type=int, default=None)
+def geo_coding(concurrency):
+    """Geocode all distributor addresses concurrently."""
+    from app import geocoding
+    started = time.time()
+    located = geocoding.bulk_geo_coding(concurrency=concurrency)
+    print('%d distributors located in %.3fs' % (located, time.time() - started))
+
+
+@manager.option('-n', '--messages', dest='messages', type=int, default=10000)
+@manager.option('-t', '--templates', dest='templates', type=int, default=10)
+@manager.option('-l', '--latency', dest='latency', type=float, default=0.05)
+def sms_benchmark(messages, templates, latency):
+    """Measure SMS dispatch throughput against a fake gateway."""
+    from app import sms_dispatch
+    queue = '%s:BENCHMARK' % sms_dispatch.SMS
+    gateway = sms_dispatch.FakeGateway({'SMS_FAKE_LATENCY': latency, 'SMS_FAKE_STATUS': sms_dispatch.BENCHMARK_STATUS})
+    # 每个请求一个手机号相当于原来逐条发送
+    for mobiles_per_request in (1, app.config['SMS_MOBILES_PER_REQUEST']):
+        for i in range(messages):
+            sms_dispatch.enqueue('199%08d' % i, 'benchmark %d' % (i % templates), queue)
+        started = time.time()
+        sent = sms_dispatch.dispatch(queue, gateway, mobiles_per_request)
+        elapsed = time.time() - started
+        print('%d mobiles per request: %d messages, %d requests, %.3fs, %.1f messages/s' %
+              (mobiles_per_request, sent, len(gateway.sent), elapsed, sent / elapsed))
+        gateway.sent = []
+        # 只删除本次压测写入的记录
+        models.SMSDelivery.query.filter(models.SMSDelivery.status == sms_dispatch.BENCHMARK_STATUS).\
+            delete(synchronize_session=False)
+        db.session.commit()
+
+
+@manager.option('-n', '--messages', dest='messages', type=int, default=500)
+@manager.option('-H', '--host', dest='host', default='127.0.0.1')
+@manager.option('-p', '--port', dest='port', type=int, default=8025)
+def mail_benchmark(messages, host, port):
+    """Measure mail throughput against an SMTP sink, e.g. python -m aiosmtpd -n -l 127.0.0.1:8025."""
+    from flask.ext.mail import Message
+    from app import mailer
+    smtp = mailer.SMTPMailer({'MAIL_SERVER': host, 'MAIL_PORT': port, 'MAIL_TIMEOUT': 10, 'MAIL_IDLE_TIMEOUT': 60})
+    # 每封邮件新建连接相当于原来的 mail.send
+    for persistent in (False, True):
+        started = time.time()
+        for i in range(messages):
+            smtp.send(Message('benchmark', sender=app.config['WMJ_MAIL_SENDER'],
+                              recipients=['%d@wanmujia.com' % i], html='<p>%d</p>' % i))
+            if not persistent:
+                smtp.close()
+        smtp.close()
+        elapsed = time.time() - started
+        print('%s: %d messages, %.3fs, %.1f messages/s' %
+              ('persistent connection' if persistent else 'connection per message', messages, elapsed,
+               messages / elapsed))
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import unittest
+from collections import namedtuple
+
+from app.areas import AreaIndex
+from app.experience import experience_stores
+
+Row = namedtuple('Row', ('id', 'cn_id', 'area', 'father_id', 'level', 'pinyin', 'pinyin_index'))
+
+
+class AreaIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = AreaIndex([
+            Row(1, 110000, u'北京', 0, 1, 'beijing', 'B'),
+            Row(2, 110100, u'北京市', 1, 2, 'beijingshi', 'B'),
+            Row(3, 110101, u'东城区', 2, 3, 'dongchengqu', 'D'),
+            Row(4, 320000, u'江苏省', 0, 1, 'jiangsusheng', 'J'),
+            Row(5, 320100, u'南京市', 4, 2, 'nanjingshi', 'N'),
+        ])
+
+    def test_address(self):
+        self.assertEqual(u'北京东城区', self.index.find(110101).area_address())
+        self.assertEqual(u'江苏省南京市', self.index.find('320100').area_address())
+        self.assertEqual([1, 2, 3], [area.id for area in self.index.get(3).grade()])
+        self.assertIsNone(self.index.find('abc'))
+
+    def test_tree(self):
+        district = self.index.find(110101)
+        self.assertEqual(2, district.city().id)
+        self.assertEqual([3], [area.id for area in district.city().children()])
+        self.assertEqual([], district.children())
+        self.assertEqual({110000: {'area': u'北京', 'children': {110100: {'area': u'北京市', 'children': {
+            110101: {'area': u'东城区', 'distributors': [7]}}}}}}, district.experience_dict(7))
+
+    def test_experience_stores(self):
+        rows = [(1, 7, 110101, '101'), (1, 8, 110101, '102'), (1, 9, 320100, '103'), (2, 9, 320100, '103'),
+                (2, 9, 999999, '103')]
+        stores = experience_stores(rows, self.index)
+        self.assertEqual({110000: {'area': u'北京', 'children': {110100: {'area': u'北京市', 'children': {
+            110101: {'area': u'东城区', 'distributors': {7: {'name': u'东城区体验馆1', 'ext_number': '101'},
+                                                         8: {'name': u'东城区体验馆2', 'ext_number': '102'}}}}}}},
+            320000: {'area': u'江苏省', 'children': {320100: {'area': u'南京市', 'children': {
+                320100: {'area': u'南京市', 'distributors': {9: {'name': u'南京市体验馆', 'ext_number': '103'}}}}}}}},
+            stores[1])
+        self.assertEqual([320000], list(stores[2]))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from tests import WMJTestCase
+from app.utils.redis import LocalCache, append_changes, read_changes, local_cached, cache_invalidate, \
+    sync_local_cache, CACHE_CHANNEL
+
+
+class LocalCacheTestCase(unittest.TestCase):
+    def test_lru(self):
+        cache = LocalCache(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_ttl(self):
+        cache = LocalCache(2, 0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+    def test_delete(self):
+        cache = LocalCache(2, 60)
+        cache.set('a', 1)
+        cache.delete('a')
+        cache.delete('b')
+        self.assertIsNone(cache.get('a'))
+
+
+class ChangeLogTestCase(WMJTestCase):
+    def test_changes(self):
+        self.redis.delete('TEST:SEQUENCE', 'TEST:CHANGES')
+        self.assertEqual(2, append_changes('TEST', ['1', '2'], kept=3))
+        self.assertEqual(['1', '2'], read_changes('TEST', 0, 2))
+        self.assertEqual([], read_changes('TEST', 2, 2))
+        self.assertEqual(4, append_changes('TEST', ['3', '4'], kept=3))
+        # 第一条已被清理
+        self.assertIsNone(read_changes('TEST', 0, 4))
+        self.assertEqual(['3', '4'], read_changes('TEST', 2, 4))
+        # 中间缺少记录时不能跳过
+        self.redis.zrem('TEST:CHANGES', '3:3')
+        self.assertIsNone(read_changes('TEST', 2, 4))
+        self.assertIsNone(read_changes('TEST', 5, 4))
+
+
+class LocalCachedTestCase(WMJTestCase):
+    def test_invalidate(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return 'v%d' % len(calls)
+
+        cache_invalidate('TEST', 'a')
+        sync_local_cache()
+        self.assertEqual('v1', local_cached('TEST', 'a', compute, 60))
+        self.assertEqual('v1', local_cached('TEST', 'a', compute, 60))
+        # 其他进程修改后删除 redis 中的缓存并发布失效通知, 本进程在下一个请求开始时丢弃进程内缓存
+        self.redis.delete('TEST:a')
+        self.redis.publish(CACHE_CHANNEL, 'TEST:a')
+        time.sleep(0.05)
+        sync_local_cache()
+        self.assertEqual('v2', local_cached('TEST', 'a', compute, 60))
+        cache_invalidate('TEST', 'a')
+        sync_local_cache()
+        self.assertEqual('v3', local_cached('TEST', 'a', compute, 60))
+        self.assertEqual('v3', local_cached('TEST', 'a', compute, 60))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from app.geocoding import BaiduGeocoder, normalize
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    模拟百度地图接口, 第一次地理编码请求返回 503 以测试重试
+    """
+    failures = 1
+
+    def reply(self, data, status=200):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if StubHandler.failures:
+            StubHandler.failures -= 1
+            return self.reply({}, 503)
+        address = parse_qs(urlparse(self.path).query)['address'][0]
+        if u'未知' in address:
+            return self.reply({'status': 1})
+        self.reply({'status': 0, 'result': {'location': {'lng': 116.4, 'lat': 39.9}}})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.reply({'status': 0, 'id': 7})
+
+    def log_message(self, *args):
+        pass
+
+
+class GeocoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever).start()
+        url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.geocoder = BaiduGeocoder({
+            'GEOCODER_AK': 'ak', 'GEOTABLE_ID': '1', 'GEOCODER_URL': url + '/geocoder',
+            'CREATE_POI_URL': url + '/create', 'UPDATE_POI_URL': url + '/update',
+            'GEOCODER_TIMEOUT': 5, 'GEOCODER_RETRIES': 3, 'GEOCODER_CONCURRENCY': 4
+        })
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_geocode(self):
+        StubHandler.failures = 1
+        self.assertEqual((116.4, 39.9), self.geocoder.geocode(u'北京市东城区'))
+        self.assertIsNone(self.geocoder.geocode(u'未知地址'))
+
+    def test_save_poi(self):
+        self.assertEqual(7, self.geocoder.save_poi(0, 1, u'体验馆', u'北京市东城区', 116.4, 39.9))
+        self.assertEqual(3, self.geocoder.save_poi(3, 1, u'体验馆', u'北京市东城区', 116.4, 39.9))
+
+    def test_normalize(self):
+        self.assertEqual(u'北京市东城区1号', normalize(u' 北京市 东城区１号 '))
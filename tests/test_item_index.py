@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from app.item_index import ItemIndex, bitmap_count
+
+
+class ItemIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        item_facets = {}
+        for item_id in range(1, 101):
+            item_facets[item_id] = {
+                'brand': item_id % 3, 'material': item_id % 5, 'category': item_id % 7 if item_id % 2 else None,
+                'style': item_id % 4, 'scene': item_id % 6, 'price': item_id * 1000 % 70000, 'item': u'椅子%d' % item_id
+            }
+        self.item_facets = item_facets
+        self.index = ItemIndex(item_facets, 0)
+
+    def expected(self, brands=None, styles=None, price=None, search=None):
+        item_ids = []
+        for item_id, facets in self.item_facets.items():
+            if brands is not None and facets['brand'] not in brands:
+                continue
+            if styles is not None and facets['style'] not in styles:
+                continue
+            if price is not None and not price[0] <= facets['price'] <= price[1]:
+                continue
+            if search is not None and search not in facets['item']:
+                continue
+            item_ids.append(item_id)
+        return sorted(item_ids, key=lambda item_id: (self.item_facets[item_id]['price'], item_id))
+
+    def test_match(self):
+        bitmap = self.index.match({'brand': [1, 2], 'style': [0]})
+        expected = self.expected(brands=[1, 2], styles=[0])
+        self.assertEqual(len(expected), bitmap_count(bitmap))
+        self.assertEqual(expected, self.index.page(bitmap, 0, 100))
+
+        bitmap = self.index.match({'brand': []})
+        self.assertEqual(0, bitmap_count(bitmap))
+
+        search_ids = [item_id for item_id in self.item_facets if u'椅子1' in self.item_facets[item_id]['item']]
+        bitmap = self.index.match({'brand': None}, price=1, search_ids=search_ids + [1000])
+        self.assertEqual(self.expected(price=(10000, 49999), search=u'椅子1'), self.index.page(bitmap, 0, 100))
+
+    def test_ranked_page(self):
+        ranked_ids = [99, 3, 1000, 50, 12, 7]
+        bitmap = self.index.match({'brand': [0]}, search_ids=ranked_ids)
+        self.assertEqual([99, 3, 12], self.index.ranked_page(bitmap, ranked_ids, 0, 10))
+        self.assertEqual([3], self.index.ranked_page(bitmap, ranked_ids, 1, 1))
+
+    def test_page(self):
+        bitmap = self.index.match({'brand': [0, 1]})
+        expected = self.expected(brands=[0, 1])
+        self.assertEqual(expected[10:20], self.index.page(bitmap, 10, 10))
+        self.assertEqual(list(reversed(expected))[10:20], self.index.page(bitmap, 10, 10, reverse=True))
+        self.assertEqual([], self.index.page(bitmap, 1000, 10))
+
+    def test_counts(self):
+        conditions = self.index.conditions({'brand': [1], 'style': [0, 1]}, price=1)
+        counts = self.index.counts(conditions)
+        for brand in range(3):
+            expected = self.expected(brands=[brand], styles=[0, 1], price=(10000, 49999))
+            self.assertEqual(len(expected), counts['brand'].get(brand, 0))
+        for style in range(4):
+            expected = self.expected(brands=[1], styles=[style], price=(10000, 49999))
+            self.assertEqual(len(expected), counts['style'].get(style, 0))
+        self.assertEqual(len(self.expected(brands=[1], styles=[0, 1], price=(1, 9999))), counts['price'][0])
+
+    def test_after(self):
+        bitmap = self.index.match({'brand': [0, 1]})
+        expected = self.expected(brands=[0, 1])
+        last = expected[9]
+        after = self.index.after(bitmap, self.item_facets[last]['price'], last)
+        self.assertEqual(expected[10:20], self.index.page(after, 0, 10))
+        expected.reverse()
+        last = expected[9]
+        after = self.index.after(bitmap, self.item_facets[last]['price'], last, reverse=True)
+        self.assertEqual(expected[10:20], self.index.page(after, 0, 10, reverse=True))
+
+    def test_update(self):
+        changes = {
+            5: dict(self.item_facets[5], style=3),
+            6: dict(self.item_facets[6], price=1, brand=7),
+            7: None,
+            200: dict(self.item_facets[8], price=35000),
+            9: dict(self.item_facets[9], category=None)
+        }
+        for item_id in changes:
+            self.index.update(item_id, changes[item_id])
+            if changes[item_id] is None:
+                del self.item_facets[item_id]
+            else:
+                self.item_facets[item_id] = changes[item_id]
+        rebuilt = ItemIndex(self.item_facets, 0)
+        self.assertEqual(rebuilt.ids, self.index.ids)
+        self.assertEqual(rebuilt.prices, self.index.prices)
+        self.assertEqual(rebuilt.bitmaps, self.index.bitmaps)
+        self.assertEqual(rebuilt.all, self.index.all)
+        self.assertEqual(rebuilt.ordinals, self.index.ordinals)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import smtplib
+import unittest
+
+from flask.ext.mail import Message
+
+from tests import WMJTestCase
+from app import mail, mailer
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class SinkHandler(object):
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.mail_from, envelope.rcpt_tos))
+        return '250 OK'
+
+
+class MailerTestCase(WMJTestCase):
+    def setUp(self):
+        super(MailerTestCase, self).setUp()
+        self.redis.delete(mailer.QUEUE, '%s:SCHEDULED' % mailer.QUEUE, '%s:RETRY' % mailer.QUEUE,
+                          '%s:PROCESSING' % mailer.QUEUE, *self.redis.keys('%s:DEDUP:*' % mailer.MAIL))
+
+    def test_dedup(self):
+        self.assertTrue(mailer.enqueue(['a@wanmujia.com'], 'subject', html='<p>a</p>'))
+        self.assertFalse(mailer.enqueue(['a@wanmujia.com'], 'subject', html='<p>a</p>'))
+        self.assertFalse(mailer.enqueue(['b@wanmujia.com'], 'subject', html='<p>a</p>'))
+        with mail.record_messages() as outbox:
+            self.assertEqual(2, mailer.dispatch())
+        self.assertEqual([['a@wanmujia.com'], ['b@wanmujia.com']], [msg.recipients for msg in outbox])
+        self.assertTrue(mailer.enqueue(['a@wanmujia.com'], 'subject', html='<p>b</p>'))
+
+    def test_retry(self):
+        class FailingMailer(object):
+            def send(self, msg):
+                raise smtplib.SMTPServerDisconnected('closed')
+
+        self.app.config['MAIL_MAX_RETRIES'] = 1
+        state = self.app.extensions['mail']
+        suppress, state.suppress = state.suppress, False
+        try:
+            self.assertTrue(mailer.enqueue(['a@wanmujia.com'], 'subject', html='<p>a</p>'))
+            self.assertEqual(0, mailer.dispatch(mailer=FailingMailer()))
+            self.assertEqual(1, self.redis.llen('%s:RETRY' % mailer.QUEUE))
+            self.assertFalse(mailer.enqueue(['a@wanmujia.com'], 'subject', html='<p>a</p>'))
+            # 重试一次仍失败后放弃, 去重标记也被删除
+            self.assertEqual(0, mailer.dispatch(mailer=FailingMailer()))
+            self.assertEqual(0, self.redis.llen('%s:RETRY' % mailer.QUEUE))
+            self.assertTrue(mailer.enqueue(['a@wanmujia.com'], 'subject', html='<p>a</p>'))
+        finally:
+            state.suppress = suppress
+
+    def test_render_email(self):
+        with self.app.test_request_context():
+            first = mailer.render_email('TEST', 'site/user_email_confirm.html', 'http://localhost/a?b=1&c=2')
+            second = mailer.render_email('TEST', 'site/user_email_confirm.html', 'http://localhost/d')
+        self.assertIn('http://localhost/a?b=1&amp;c=2', first)
+        self.assertNotIn(mailer.URL_PLACEHOLDER, first)
+        self.assertIn('http://localhost/d', second)
+
+    @unittest.skipIf(Controller is None, 'aiosmtpd is not installed')
+    def test_smtp_sink(self):
+        handler = SinkHandler()
+        controller = Controller(handler, hostname='127.0.0.1', port=8025)
+        controller.start()
+        try:
+            smtp = mailer.SMTPMailer({'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': 8025, 'MAIL_TIMEOUT': 5,
+                                      'MAIL_IDLE_TIMEOUT': 60})
+            for i in range(3):
+                smtp.send(Message('subject', sender='notification@wanmujia.com',
+                                  recipients=['%d@wanmujia.com' % i], body='body'))
+            host = smtp.host
+            self.assertIsNotNone(host)
+            # 服务器关闭连接后重新连接
+            host.close()
+            smtp.send(Message('subject', sender='notification@wanmujia.com', recipients=['3@wanmujia.com'],
+                              body='body'))
+            smtp.close()
+        finally:
+            controller.stop()
+        self.assertEqual(['%d@wanmujia.com' % i for i in range(4)], [rcpt_tos[0] for _, rcpt_tos in handler.messages])
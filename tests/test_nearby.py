@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from app.nearby import NearbyIndex, NearbyStore, distance
+
+
+class NearbyIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.index = NearbyIndex()
+        self.stores = []
+        for distributor_id in range(1, 501):
+            store = NearbyStore(distributor_id, u'体验馆', u'地址', '', 110101,
+                                random.uniform(73, 135), random.uniform(18, 53))
+            item_ids = random.sample(range(100), 5)
+            self.index.add(store, item_ids)
+            self.stores.append((store, item_ids))
+
+    def brute_force(self, lng, lat, k, item_id=None):
+        stores = sorted(self.stores, key=lambda x: distance(lng, lat, x[0].longitude, x[0].latitude))
+        return [store.id for store, item_ids in stores if item_id is None or item_id in item_ids][:k]
+
+    def test_nearest(self):
+        for _ in range(50):
+            lng, lat = random.uniform(73, 135), random.uniform(18, 53)
+            self.assertEqual(self.brute_force(lng, lat, 10),
+                             [store.id for _, store in self.index.nearest(lng, lat, 10)])
+            self.assertEqual(self.brute_force(lng, lat, 3, 7),
+                             [store.id for _, store in self.index.nearest(lng, lat, 3, 7)])
+
+    def test_remove(self):
+        for store, item_ids in self.stores[:250]:
+            self.index.remove(store.id)
+        self.stores = self.stores[250:]
+        self.assertEqual(self.brute_force(116.4, 39.9, 10),
+                         [store.id for _, store in self.index.nearest(116.4, 39.9, 10)])
+
+    def test_unlocated(self):
+        self.index.add(NearbyStore(1000, u'体验馆', u'地址', '', 110101, 0, 0), [1])
+        self.assertNotIn(1000, self.index.stores)
+        self.index.add(NearbyStore(1001, u'体验馆', u'地址', '', 110101, 116.4, 39.9), [])
+        self.assertNotIn(1001, self.index.stores)
+
+    def test_far_away(self):
+        # 远离所有经销商时不能一圈圈扫到经销商所在的网格
+        for lng, lat in ((-170, -80), (180, 90), (1e7, 0)):
+            self.assertEqual(self.brute_force(lng, lat, 10),
+                             [store.id for _, store in self.index.nearest(lng, lat, 10)])
+        index = NearbyIndex()
+        index.add(NearbyStore(1, u'体验馆', u'地址', '', 110101, 116.4, 39.9), [1])
+        self.assertEqual([1], [store.id for _, store in index.nearest(-170, -80, 10)])
+        self.assertEqual([], NearbyIndex().nearest(116.4, 39.9, 10))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from tests import WMJTestCase
+from app import sms_dispatch
+from app.models import SMSDelivery
+from app.sms_dispatch import FakeGateway, batches
+from app.utils.redis import queue_pop
+
+
+class SMSDispatchTestCase(unittest.TestCase):
+    def test_batches(self):
+        entries = [{'mobile': '1310000000%d' % i, 'message': 'a' if i % 3 else 'b'} for i in range(10)]
+        result = list(batches(entries, 3))
+        self.assertEqual(10, sum(len(group) for message, group in result))
+        for message, group in result:
+            self.assertLessEqual(len(group), 3)
+            self.assertTrue(all(entry['message'] == message for entry in group))
+        self.assertEqual(2, len([message for message, group in result if message == 'b']))
+        self.assertEqual(3, len([message for message, group in result if message == 'a']))
+
+    def test_fake_gateway(self):
+        gateway = FakeGateway({})
+        self.assertEqual(0, gateway.send(['13100000000', '13100000001'], 'a'))
+        self.assertEqual([(['13100000000', '13100000001'], 'a')], gateway.sent)
+
+
+class SMSRetryTestCase(WMJTestCase):
+    QUEUE = 'SMS:TEST'
+
+    def setUp(self):
+        super(SMSRetryTestCase, self).setUp()
+        self.redis.delete(self.QUEUE, '%s:RETRY' % self.QUEUE, '%s:PROCESSING' % self.QUEUE)
+        self.app.config['SMS_MAX_RETRIES'] = 2
+
+    def test_retry(self):
+        sms_dispatch.enqueue('13100000000', 'a', self.QUEUE)
+        gateway = FakeGateway({'SMS_FAKE_STATUS': 1})
+        # 第一次发送和两次重试都失败后放弃
+        for retries in range(3):
+            self.assertEqual(1, sms_dispatch.dispatch(self.QUEUE, gateway))
+            pending = self.redis.lrange('%s:RETRY' % self.QUEUE, 0, -1)
+            self.assertEqual([retries + 1] if retries < 2 else [], [json.loads(entry.decode())['retries']
+                                                                   for entry in pending])
+        self.assertEqual(0, sms_dispatch.dispatch(self.QUEUE, gateway))
+        self.assertEqual(3, SMSDelivery.query.filter_by(mobile='13100000000', status=1).count())
+
+    def test_recover(self):
+        sms_dispatch.enqueue('13100000000', 'a', self.QUEUE)
+        # 取出后进程中断, 超时后由下一次发送任务放回队列
+        batch, entries = queue_pop(self.QUEUE, 10, -1)
+        self.assertEqual(1, len(entries))
+        gateway = FakeGateway({})
+        self.assertEqual(1, sms_dispatch.dispatch(self.QUEUE, gateway))
+        self.assertEqual([(['13100000000'], 'a')], gateway.sent)
+        self.assertFalse(self.redis.exists(batch))
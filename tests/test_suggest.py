@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import unittest
+from collections import deque
+
+from app import statisitc, suggest
+from app.suggest import SuggestTrie, statistic_terms, get_trie
+
+
+class SuggestTrieTestCase(unittest.TestCase):
+    def setUp(self):
+        self.terms = {
+            ('brand', 1, u'红星'): 30,
+            ('category', 5, u'红木家具'): 12,
+            ('item', None, u'红木沙发'): 1,
+            ('item', None, u'红木椅'): 2
+        }
+        self.trie = SuggestTrie(self.terms)
+
+    def texts(self, trie, prefix):
+        return [suggestion['text'] for suggestion in trie.suggest(prefix)]
+
+    def test_suggest(self):
+        self.assertEqual([u'红星', u'红木家具', u'红木椅', u'红木沙发'], self.texts(self.trie, u'红'))
+        self.assertEqual([u'红木家具', u'红木椅', u'红木沙发'], self.texts(self.trie, u'红木'))
+        self.assertEqual([u'红木沙发'], self.texts(self.trie, u'红木 沙'))
+        self.assertEqual([u'红星'], self.texts(self.trie, u'红星'))
+        self.assertEqual([], self.texts(self.trie, u'黄'))
+        self.assertEqual(1, len(self.trie.suggest(u'红', 1)))
+
+    def test_update(self):
+        terms = dict(self.terms)
+        del terms[('brand', 1, u'红星')]
+        terms[('item', None, u'红木沙发')] = 20
+        terms[('material', 3, u'红酸枝')] = 5
+        self.trie.update(terms)
+        rebuilt = SuggestTrie(terms)
+        for prefix in (u'红', u'红木', u'红星', u'红酸'):
+            self.assertEqual(rebuilt.suggest(prefix), self.trie.suggest(prefix))
+        self.assertEqual(u'红木沙发', self.texts(self.trie, u'红')[0])
+
+
+def _facets(brand, material, category, name):
+    return {'brand': brand, 'material': material, 'category': category, 'style': None, 'scene': None,
+            'price': 10000, 'item': name}
+
+
+class SuggestStatisticTestCase(unittest.TestCase):
+    NAMES = ('brands', 'materials', 'categories', 'counters', 'item_facets', 'generation', 'recent_changes')
+
+    def setUp(self):
+        self.saved = {name: getattr(statisitc, name) for name in self.NAMES}
+        statisitc.brands = {'available': {1: {'brand': u'红星'}, 2: {'brand': u'红日'}}, 'available_set': {1, 2}}
+        statisitc.materials = {'available': {3: {'material': u'红酸枝'}, 4: {'material': u'红花梨'}},
+                               'available_set': {3, 4}}
+        statisitc.categories = {'available': {5: {'category': u'红木家具', 'children': {
+            6: {'category': u'红木椅类', 'children': {}}, 7: {'category': u'红木床类', 'children': {}}}}}}
+        statisitc.item_facets = {1: _facets(1, 3, 6, u'红木椅'), 2: _facets(2, 3, 6, u'红木沙发'),
+                                 3: _facets(2, 4, None, u'红木椅')}
+        statisitc.generation = 1
+        statisitc.recent_changes = deque(maxlen=1000)
+        self.count()
+        suggest._trie = None
+
+    def tearDown(self):
+        for name in self.NAMES:
+            setattr(statisitc, name, self.saved[name])
+        suggest._trie = None
+
+    def count(self):
+        statisitc.counters = {facet: {} for facet in statisitc.FACETS}
+        for facets in statisitc.item_facets.values():
+            for facet in statisitc.FACETS:
+                if facets[facet] is not None:
+                    counter = statisitc.counters[facet]
+                    counter[facets[facet]] = counter.get(facets[facet], 0) + 1
+
+    def change(self, items):
+        for item_id, facets in items.items():
+            if facets is None:
+                statisitc.item_facets.pop(item_id, None)
+            else:
+                statisitc.item_facets[item_id] = facets
+        self.count()
+        statisitc.generation += 1
+        statisitc.recent_changes.append((statisitc.generation, set(items)))
+
+    def assert_rebuilt(self, trie):
+        rebuilt = SuggestTrie(statistic_terms())
+        self.assertEqual(rebuilt.weights, trie.weights)
+        for prefix in (u'红', u'红木', u'红木椅', u'红日', u'红花', u'红木床'):
+            self.assertEqual(rebuilt.suggest(prefix), trie.suggest(prefix))
+
+    def test_incremental(self):
+        trie = get_trie()
+        self.change({1: _facets(2, 4, 7, u'红木床'), 4: _facets(1, 3, 6, u'红木椅')})
+        self.assertIs(trie, get_trie())
+        self.assert_rebuilt(trie)
+        self.change({2: None, 3: None})
+        self.assertIs(trie, get_trie())
+        self.assert_rebuilt(trie)
+        self.assertEqual(statisitc.generation, trie.generation)
+
+    def test_reload(self):
+        trie = get_trie()
+        statisitc.item_facets = dict(statisitc.item_facets)
+        self.assertIsNot(trie, get_trie())
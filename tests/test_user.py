@@ -2,7 +2,7 @@
 from flask import url_for
 
 from tests import WMJTestCase
-from app import db, statisitc
+from app import db, statisitc, item_detail
 from app.models import User, Item, Vendor
 
 
@@ -108,3 +108,34 @@ class UserTestCase(WMJTestCase):
 
         response = self.client.get(url_for('main.index'))
         self.assert_ok_html(response)
+
+        # item detail is cached without the user's collected flag
+        item = Item.query.filter_by(is_deleted=False, is_component=False).first()
+        for _ in range(2):
+            response = self.client.get(url_for('item.detail', item_id=item.id, format='json', action='detail'))
+            self.assert_ok_json(response)
+            json_response = self.load_json(response)
+            self.assertEqual(item.id, json_response['item']['id'])
+            self.assertFalse(json_response['item']['collected'])
+
+        # repeat visitors get 304 until the item changes
+        url = url_for('item.detail', item_id=item.id, format='json', action='detail')
+        etag = self.client.get(url).headers['ETag']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assert_status_code(response, 304)
+
+        # compressed responses carry their own ETag and still revalidate
+        self.app.config['COMPRESS_MIN_SIZE'] = 0
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('%s-gzip"' % etag[:-1], response.headers['ETag'])
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+        self.assert_status_code(response, 304)
+
+        # a change gets a new version, a rebuild started before it cannot be served again
+        version = item_detail.detail_version(item.id)
+        item_detail.invalidate_detail(item.id)
+        item_detail.invalidate_detail(item.id)
+        self.assertGreaterEqual(item_detail.detail_version(item.id), version + 2)
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assert_ok_json(response)
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 import base64
 import json
+import os
+import tempfile
 from io import BytesIO
 from flask import url_for
 
 from tests import WMJTestCase
-from app import db
-from app.models import Vendor, Item
+from app import db, statisitc, dictionary, experience, snapshot
+from app.models import Vendor, Item, Style, prefetch
 
 
 class VendorTestCase(WMJTestCase):
@@ -375,3 +377,102 @@ class VendorTestCase(WMJTestCase):
         for component in suite.components:
             self.assertIsNotNone(component)
             self.assertTrue(component.is_deleted)
+
+    def test_statistic(self):
+        Vendor.generate_fake(5)
+        Item.generate_fake(2)
+        statisitc.rebuild_statistic()
+        statisitc.publish_statistic()
+        snapshot_generation = statisitc.generation
+
+        # incremental statistic is the same as rebuilt statistic
+        for item in Item.query.filter_by(is_component=False).limit(5):
+            item.is_deleted = True
+            db.session.commit()
+            statisitc.item_changed(item)
+        item = Item.query.filter_by(is_deleted=False, is_component=False).first()
+        item.style_id = 1
+        db.session.commit()
+        statisitc.item_changed(item)
+        incremental = statisitc._available_snapshot()
+
+        # another worker reads the snapshot and applies the change log
+        statisitc.item_facets = None
+        statisitc.load_statistic()
+        self.assertGreater(statisitc.generation, snapshot_generation)
+        self.assertEqual(incremental, statisitc._available_snapshot())
+        statisitc.init_statistic()
+        self.assertEqual(incremental, statisitc._available_snapshot())
+
+        # another worker swaps to the published generation
+        generation = statisitc.generation
+        data = statisitc.dumps_statistic()
+        statisitc.brands = None
+        statisitc.loads_statistic(data)
+        self.assertEqual(generation, statisitc.generation)
+        self.assertEqual(incremental['brand'], statisitc.brands['available_set'])
+
+    def test_snapshot(self):
+        Vendor.generate_fake(5)
+        Item.generate_fake(2)
+        statisitc.init_statistic()
+        path = os.path.join(tempfile.mkdtemp(), 'snapshot.bin')
+        snapshot.save_snapshot(path)
+        item_facets = statisitc.item_facets
+        statisitc.item_facets = None
+        self.assertTrue(snapshot.load_snapshot(path))
+        self.assertEqual(item_facets, statisitc.item_facets)
+
+        # snapshot written with another schema is ignored
+        with open(path, 'r+b') as f:
+            f.write(b'WMJSNAPSHOT 0')
+        self.assertFalse(snapshot.load_snapshot(path))
+
+        # truncated or empty snapshots are ignored as well
+        snapshot.save_snapshot(path)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) // 2)
+        self.assertFalse(snapshot.load_snapshot(path))
+        with open(path, 'r+b') as f:
+            f.truncate(f.readline() and f.tell())
+        self.assertFalse(snapshot.load_snapshot(path))
+
+    def test_item_stores(self):
+        Vendor.generate_fake(5)
+        Item.generate_fake(2)
+        item = Item.query.filter_by(is_deleted=False, is_component=False).first()
+        stores = experience.item_stores(item.id)
+        self.assertIs(stores, experience.item_stores(item.id))
+
+        # another worker drops the invalidated item on its next request
+        experience.sync_stores()
+        sequence = experience.sequence
+        experience.invalidate([item.id])
+        experience._cache[item.id] = stores
+        experience.sync_stores()
+        self.assertEqual(sequence + 1, experience.sequence)
+        self.assertNotIn(item.id, experience._cache)
+
+    def test_dictionary(self):
+        Vendor.generate_fake(5)
+        Item.generate_fake(2)
+        item = Item.query.filter_by(is_deleted=False, is_suite=False, is_component=False).first()
+        self.assertEqual(Style.query.get(item.style_id).style, item.style)
+
+        # committed changes invalidate every worker's cache
+        version = dictionary.version
+        Style.query.get(item.style_id).style = u'新风格'
+        db.session.commit()
+        self.assertNotEqual(version, dictionary.version)
+        item.flush('style')
+        self.assertEqual(u'新风格', item.style)
+
+    def test_prefetch(self):
+        Vendor.generate_fake(5)
+        Item.generate_fake(2)
+        items = prefetch(Item.query.filter_by(is_deleted=False).all(), 'vendor', 'images')
+        for item in items:
+            self.assertEqual(Vendor.query.get(item.vendor_id).brand, item.vendor.brand)
+            images = item._flush['images'](item).all()
+            self.assertEqual([image.id for image in images], [image.id for image in item.images])
+            self.assertEqual(images[0].id if images else None, item.images.first() and item.images.first().id)